@@ -99,12 +99,225 @@ def check_routes(app):
         assert route in rules, f"Missing route: {route}"
 
 
+@check("Users API loads roles without N+1 queries")
+def check_users_api_queries(app):
+    from uuid import uuid4
+
+    from sqlalchemy import event
+
+    from enferno.extensions import db
+    from enferno.user.models import Role, User
+    from enferno.user.views import api_user
+
+    statements = []
+
+    def count_query(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.test_request_context("/api/users?per_page=100"):
+        role = Role(name=f"check-{uuid4().hex}")
+        db.session.add_all(
+            User(email=f"{uuid4().hex}@check.local", password="x", roles=[role])
+            for _ in range(20)
+        )
+        db.session.flush()
+        db.session.expire_all()
+
+        event.listen(db.engine, "before_cursor_execute", count_query)
+        try:
+            api_user()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count_query)
+            db.session.rollback()
+
+    # page + roles batch + (possibly cached) total
+    assert len(statements) <= 4, f"{len(statements)} queries for one users page"
+
+
+@check("Users API answers unchanged pages with 304 and no queries")
+def check_users_api_etag(app):
+    from sqlalchemy import event
+
+    from enferno.extensions import db
+    from enferno.user.views import api_user
+
+    statements = []
+
+    def count_query(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.test_request_context("/api/users"):
+        etag = api_user().get_etag()[0]
+    with app.test_request_context("/api/users", headers={"If-None-Match": f'"{etag}"'}):
+        event.listen(db.engine, "before_cursor_execute", count_query)
+        try:
+            response = api_user()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count_query)
+
+    assert response.status_code == 304, f"got {response.status_code}"
+    assert not statements, f"{len(statements)} queries for a 304"
+
+
+@check("Activities cursor mode clamps per_page")
+def check_activities_cursor_per_page(app):
+    from sqlalchemy import event
+
+    from enferno.extensions import db
+    from enferno.user.views import MAX_PER_PAGE, api_activities
+
+    limits = []
+
+    def capture_limit(conn, cursor, statement, parameters, *args):
+        if "LIMIT" in statement:
+            params = parameters.values() if isinstance(parameters, dict) else parameters
+            limits.append(list(params))
+
+    for per_page, expected in ((-2, 1), (10**6, MAX_PER_PAGE)):
+        limits.clear()
+        with app.test_request_context(f"/api/activities?after=&per_page={per_page}"):
+            event.listen(db.engine, "before_cursor_execute", capture_limit)
+            try:
+                response = api_activities()
+            finally:
+                event.remove(db.engine, "before_cursor_execute", capture_limit)
+
+        body = response.get_json()
+        assert body["perPage"] == expected, f"perPage {body['perPage']}"
+        assert len(body["items"]) <= expected
+        assert limits and expected + 1 in limits[0], f"LIMIT params {limits}"
+
+
+@check("Bulk API fails bad operations per item and applies the rest")
+def check_bulk_mixed_batch(app):
+    from uuid import uuid4
+
+    from sqlalchemy import insert
+    from sqlalchemy.orm import Session
+
+    from enferno.extensions import audit, db
+    from enferno.user.models import Activity, User
+    from enferno.utils.bulk import bulk_roles, bulk_users
+
+    with app.test_request_context("/api/users/bulk"), db.engine.connect() as conn:
+        # Everything below, the bulk commits included, runs in savepoints of
+        # this transaction and is rolled back at the end
+        outer = conn.begin()
+        session = Session(bind=conn, join_transaction_mode="create_savepoint")
+        db.session.registry.set(session)
+        try:
+            actor = User(email=f"{uuid4().hex}@check.local", password="x")
+            session.add(actor)
+            session.commit()
+            missing = actor.id + 10**6
+
+            results = bulk_users(
+                [
+                    {"op": "update", "id": actor.id, "item": {"name": "Checked"}},
+                    {"op": "update", "id": [actor.id], "item": {}},
+                    {"op": "create", "item": {"email": {}, "password": "x" * 12}},
+                    {"op": "update", "id": missing, "item": {"active": "yes"}},
+                    {"op": "update", "id": missing + 1, "item": {"username": {}}},
+                    {"op": "update", "id": missing + 2, "item": {"name": "x" * 300}},
+                    {"op": "update", "id": missing + 3, "item": {"email": None}},
+                    {"op": "update", "id": missing + 4, "item": {"roles": [{}]}},
+                ],
+                actor.id,
+            )
+            assert [r["ok"] for r in results] == [True] + [False] * 7, results
+            assert session.get(User, actor.id).name == "Checked"
+
+            results = bulk_roles(
+                [
+                    {"op": "create", "item": {"name": f"check-{uuid4().hex}"}},
+                    {"op": "create", "item": {"description": ["x"]}},
+                    {"op": "delete", "id": "1"},
+                ],
+                actor.id,
+            )
+            assert [r["ok"] for r in results] == [True, False, False], results
+
+            # The audit rows of the applied operations must be insertable too
+            rows = audit._drain()
+            assert len(rows) == 2, f"{len(rows)} audit rows"
+            conn.execute(insert(Activity).values(rows))
+        finally:
+            db.session.remove()
+            outer.rollback()
+
+
+@check("Shared cache counters restart after expiry")
+def check_cache_inc_after_expiry(app):
+    import os
+    import tempfile
+
+    from enferno.utils.cache import SQLiteCache
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = SQLiteCache(os.path.join(tmp, "cache.sqlite"))
+        cache.set("counter", 5, timeout=1)
+        cache._db().execute("UPDATE cache SET expires = 0 WHERE key = 'counter'")
+        assert cache.inc("counter") == 1
+        assert cache.get("counter") == 1, "expired counter stays unreadable"
+
+
+@check("Mail outbox batches over one SMTP connection and retries")
+def check_mail_outbox(app):
+    import time
+
+    from flask import Flask
+    from flask_mail import Mail
+
+    from enferno.utils.mail import LocalSMTPServer, MailOutbox
+
+    with LocalSMTPServer() as server:
+        mail_app = Flask(__name__)
+        mail_app.config.update(
+            MAIL_SERVER=server.host,
+            MAIL_PORT=server.port,
+            MAIL_USE_SSL=False,
+            MAIL_OUTBOX_MODE="thread",
+            MAIL_RETRY_BACKOFF=0.01,
+        )
+        Mail(mail_app)
+        outbox = MailOutbox(mail_app)
+
+        server.fail_next = 1
+        for i in range(5):
+            outbox.send(
+                {
+                    "subject": f"Check {i}",
+                    "sender": "check@check.local",
+                    "recipients": ["user@check.local"],
+                    "body": "Hello",
+                }
+            )
+        deadline = time.monotonic() + 5
+        while len(server.messages) < 5 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        outbox.close()
+
+    assert len(server.messages) == 5, f"{len(server.messages)} of 5 delivered"
+    assert server.connections == 1, f"{server.connections} SMTP connections"
+
+
 @check("Security config is sane")
 def check_security_config(app):
     assert app.config["SECURITY_PASSWORD_LENGTH_MIN"] >= 8
     assert app.config["SESSION_USE_SIGNER"] is True
 
 
+@check("Password hashing uses the configured cost")
+def check_password_hash_cost(app):
+    rounds = app.config["PASSWORD_HASH_ROUNDS"]
+    if app.config["SECURITY_PASSWORD_HASH"] == "bcrypt":
+        assert rounds, "bcrypt would fall back to passlib's cost of 12"
+    if rounds:
+        context = app.extensions["security"].pwd_context
+        handler = context.handler(app.config["SECURITY_PASSWORD_HASH"])
+        assert handler.default_rounds == rounds, f"{handler.default_rounds} rounds"
+
+
 # =============================================================================
 # RUNNER
 # =============================================================================
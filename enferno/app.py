@@ -2,30 +2,50 @@ import inspect
 
 import click
 from flask import Flask, render_template
-from flask_dance.consumer.storage.sqla import SQLAlchemyStorage
-from flask_dance.contrib.github import make_github_blueprint
-from flask_dance.contrib.google import make_google_blueprint
-from flask_security import Security, SQLAlchemyUserDatastore, current_user
+from flask_security import Security, current_user
 
 import enferno.commands as commands
-from enferno.extensions import babel, cache, db, debug_toolbar, mail, session
+from enferno.extensions import (
+    assets,
+    audit,
+    babel,
+    cache,
+    compression,
+    db,
+    hasher,
+    identity,
+    instrumentation,
+    metrics,
+    outbox,
+    role_registry,
+    session,
+    session_tracker,
+)
 from enferno.portal.views import portal
-from enferno.public.views import public
+from enferno.public.views import connect_oauth_signals, public
 from enferno.settings import Config
 from enferno.user.forms import ExtendedRegisterForm, OAuthAwareChangePasswordForm
 from enferno.user.models import OAuth, Role, User, WebAuthn
 from enferno.user.views import bp_user
+from enferno.utils.identity import CachingUserDatastore
+from enferno.utils.mail import OutboxMailUtil
+from enferno.utils.templates import bytecode_cache, preload_templates
 
 
 def create_app(config_object=Config):
     app = Flask(__name__)
     app.config.from_object(config_object)
+    # Before anything touches app.jinja_env, which is created on first use
+    app.jinja_options = {**app.jinja_options, "bytecode_cache": bytecode_cache(app)}
 
     register_blueprints(app)
     register_extensions(app)
     register_errorhandlers(app)
     register_shellcontext(app)
     register_commands(app, commands)
+
+    if app.config.get("TEMPLATES_PRELOAD") and not app.debug:
+        preload_templates(app)
     return app
 
 
@@ -34,22 +54,51 @@ def locale_selector():
 
 
 def register_extensions(app):
+    # First, so its after_request hook runs last and times everything else
+    instrumentation.init_app(app)
+    # Next, so responses are compressed after every other hook has run
+    compression.init_app(app)
+    assets.init_app(app)
     cache.init_app(app)
+    # After cache to wrap its backend, before db to set the engine pool class
+    metrics.init_app(app)
+    # Before db so its teardown flush runs after the request session is removed
+    audit.init_app(app)
     db.init_app(app)
-    user_datastore = SQLAlchemyUserDatastore(db, User, Role, webauthn_model=WebAuthn)
+    identity.init_app(app)
+    role_registry.init_app(app)
+    user_datastore = CachingUserDatastore(db, User, Role, webauthn_model=WebAuthn)
     Security(
         app,
         user_datastore,
         register_form=ExtendedRegisterForm,
         change_password_form=OAuthAwareChangePasswordForm,
+        mail_util_cls=OutboxMailUtil,
     )
-    mail.init_app(app)
-    debug_toolbar.init_app(app)
+    hasher.init_app(app)
+
+    # Optional subsystems are imported only when configured
+    if app.config.get("MAIL_SERVER"):
+        from flask_mail import Mail
+
+        Mail(app)
+        outbox.init_app(app)
+    if app.config.get("DEBUG_TB_ENABLED"):
+        from flask_debugtoolbar import DebugToolbarExtension
+
+        DebugToolbarExtension(app)
 
     # Session initialization - pass db for SQLAlchemy sessions
     if app.config.get("SESSION_TYPE") == "sqlalchemy":
         app.config["SESSION_SQLALCHEMY"] = db
+    elif app.config.get("SESSION_TYPE") == "redis" and not app.config.get(
+        "SESSION_REDIS"
+    ):
+        import redis
+
+        app.config["SESSION_REDIS"] = redis.from_url(app.config["SESSION_REDIS_URL"])
     session.init_app(app)
+    session_tracker.init_app(app)
 
     babel.init_app(
         app,
@@ -66,10 +115,23 @@ def register_blueprints(app):
     app.register_blueprint(public)
     app.register_blueprint(portal)
 
-    # Setup OAuth if enabled
-    if app.config.get("GOOGLE_AUTH_ENABLED") and app.config.get(
+    # Setup OAuth if enabled; flask_dance is only imported when it is
+    google = app.config.get("GOOGLE_AUTH_ENABLED") and app.config.get(
         "GOOGLE_OAUTH_CLIENT_ID"
-    ):
+    )
+    github = app.config.get("GITHUB_AUTH_ENABLED") and app.config.get(
+        "GITHUB_OAUTH_CLIENT_ID"
+    )
+    if not (google or github):
+        return None
+
+    from flask_dance.consumer.storage.sqla import SQLAlchemyStorage
+
+    connect_oauth_signals()
+
+    if google:
+        from flask_dance.contrib.google import make_google_blueprint
+
         google_bp = make_google_blueprint(
             client_id=app.config.get("GOOGLE_OAUTH_CLIENT_ID"),
             client_secret=app.config.get("GOOGLE_OAUTH_CLIENT_SECRET"),
@@ -83,9 +145,9 @@ def register_blueprints(app):
         google_bp.storage = SQLAlchemyStorage(OAuth, db.session, user=current_user)
         app.register_blueprint(google_bp, url_prefix="/login")
 
-    if app.config.get("GITHUB_AUTH_ENABLED") and app.config.get(
-        "GITHUB_OAUTH_CLIENT_ID"
-    ):
+    if github:
+        from flask_dance.contrib.github import make_github_blueprint
+
         github_bp = make_github_blueprint(
             client_id=app.config.get("GITHUB_OAUTH_CLIENT_ID"),
             client_secret=app.config.get("GITHUB_OAUTH_CLIENT_SECRET"),
@@ -100,6 +162,10 @@ def register_blueprints(app):
 def register_errorhandlers(app):
     def render_error(error):
         error_code = getattr(error, "code", 500)
+        if error_code == 500:
+            # A failed flush leaves the session unusable, and the error page
+            # loads the current user through it
+            db.session.rollback()
         return render_template(f"{error_code}.html"), error_code
 
     for errcode in [401, 404, 500]:
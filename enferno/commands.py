@@ -3,6 +3,7 @@
 import os
 import secrets
 import string
+from datetime import datetime
 
 import click
 from flask.cli import AppGroup, with_appcontext
@@ -23,16 +24,31 @@ def create_db():
     print("Database structure created successfully")
 
 
+@click.command()
+@with_appcontext
+def create_indexes():
+    """Add indexes defined on the models to existing tables (run after upgrades)."""
+    from enferno.utils.indexes import create_missing_indexes
+
+    created = 0
+    for name in create_missing_indexes():
+        console.print(f"[green]✓[/] Created index [blue]{name}[/]")
+        created += 1
+    if not created:
+        console.print("Indexes are already up to date.")
+
+
 @click.command()
 @click.option("-e", "--email", default=None, help="Admin email")
 @click.option("-p", "--password", default=None, help="Admin password")
 @with_appcontext
 def install(email, password):
     """Install a default admin user and add an admin role to it."""
+    from enferno.extensions import role_registry
     from enferno.user.models import Role
 
     # create admin role if it doesn't exist
-    admin_role = Role.query.filter(Role.name == "admin").first()
+    admin_role = role_registry.instance("admin")
     if not admin_role:
         admin_role = Role(name="admin").save()
 
@@ -95,6 +111,7 @@ def create(email, password):
 @with_appcontext
 def add_role(email, role):
     """Adds a role to the specified user."""
+    from enferno.extensions import role_registry
     from enferno.user.models import Role
 
     u = User.query.filter(User.email == email).first()
@@ -102,7 +119,7 @@ def add_role(email, role):
     if u is None:
         print("Sorry, this user does not exist!")
     else:
-        r = db.session.execute(db.select(Role).filter_by(name=role)).scalar_one()
+        r = role_registry.instance(role)
         if r is None:
             print("Sorry, this role does not exist!")
             u = click.prompt("Would you like to create one? Y/N", default="N")
@@ -142,6 +159,16 @@ def reset(email, password):
         print(f"Error resetting user password: {e}")
 
 
+@click.command()
+@with_appcontext
+def reconcile_counters():
+    """Recount the cached dashboard counters against the database."""
+    from enferno.utils.counters import MODELS, reconcile
+
+    for table in MODELS:
+        console.print(f"[blue]{table}:[/] {reconcile(table):,}")
+
+
 i18n_cli = AppGroup("i18n")
 
 
@@ -172,3 +199,448 @@ def compile():
     """Compile translations"""
     if os.system("pybabel compile -d enferno/translations"):
         raise RuntimeError("Compile command failed")
+
+
+activities_cli = AppGroup("activities", help="Activity log maintenance.")
+
+
+@activities_cli.command()
+@click.option(
+    "--older-than", default="90d", show_default=True, help="Age cutoff: 36h, 90d, 12w"
+)
+@click.option(
+    "-o",
+    "--output",
+    default=None,
+    help="Archive directory (default: instance/archive/activities)",
+)
+@click.option("--batch-size", default=5000, show_default=True)
+@click.option("--keep", is_flag=True, help="Export only, do not delete rows")
+def archive(older_than, output, batch_size, keep):
+    """Export old activities to gzipped JSONL files and delete them."""
+    from flask import current_app
+
+    from enferno.utils.archive import archive_activities, parse_duration
+
+    try:
+        cutoff = datetime.now() - parse_duration(older_than)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--older-than") from e
+
+    output = output or os.path.join(current_app.instance_path, "archive", "activities")
+    console.print(
+        f"Archiving activities before [blue]{cutoff:%Y-%m-%d %H:%M}[/] to {output}"
+    )
+
+    total = 0
+    with console.status("Archiving...") as status:
+        for count in archive_activities(
+            cutoff, output, batch_size=batch_size, delete_rows=not keep
+        ):
+            total += count
+            status.update(f"Archived {total:,} activities...")
+
+    console.print(f"[green]✓[/] Archived {total:,} activities")
+
+
+def write_export(chunks, output):
+    """Write export chunks to a file, or stdout when no path is given."""
+    if output:
+        with open(output, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+    else:
+        out = click.get_binary_stream("stdout")
+        for chunk in chunks:
+            out.write(chunk)
+        out.flush()
+
+
+@activities_cli.command("export")
+@click.option("-o", "--output", default=None, help="Output file (default: stdout)")
+@click.option(
+    "-f", "--format", "fmt", type=click.Choice(["ndjson", "csv"]), default="ndjson"
+)
+@click.option("--user-id", default=None, type=int)
+@click.option("--action", default=None)
+@click.option("--date-from", default=None, help="ISO date or datetime")
+@click.option("--date-to", default=None, help="ISO date or datetime, inclusive")
+def export_activities(output, fmt, user_id, action, date_from, date_to):
+    """Stream activities, newest first, as NDJSON or CSV."""
+    from enferno.user.models import Activity
+    from enferno.utils.export import ACTIVITY_FIELDS, activity_rows, stream
+
+    try:
+        filters = Activity.filters(
+            {
+                "user_id": user_id,
+                "action": action,
+                "date_from": date_from,
+                "date_to": date_to,
+            }
+        )
+    except ValueError as e:
+        raise click.BadParameter(str(e)) from e
+
+    write_export(stream(activity_rows(filters), ACTIVITY_FIELDS, fmt), output)
+
+
+@activities_cli.command()
+def replay():
+    """Write audit rows spooled by failed flushes back to the activity table."""
+    from enferno.extensions import audit
+    from enferno.utils.audit import AuditUnavailable
+
+    try:
+        total = audit.replay()
+    except AuditUnavailable as e:
+        console.print(f"[red]Replay stopped, {len(e.rows):,} rows left:[/] {e}")
+        raise SystemExit(1) from None
+    console.print(f"[green]✓[/] Replayed {total:,} spooled activities")
+
+
+@activities_cli.command()
+@click.option("--months-ahead", default=3, show_default=True)
+def partition(months_ahead):
+    """Set up monthly range partitions for activities (PostgreSQL only)."""
+    from enferno.utils.archive import partition_activities
+
+    if db.engine.dialect.name != "postgresql":
+        console.print("[yellow]Partitioning is only supported on PostgreSQL.[/]")
+        return
+
+    created = partition_activities(months_ahead=months_ahead)
+    for name in created:
+        console.print(f"[green]✓[/] Created partition [blue]{name}[/]")
+    if not created:
+        console.print("Partitions are already up to date.")
+
+
+users_cli = AppGroup("users", help="Bulk user management.")
+
+
+@users_cli.command("export")
+@click.option("-o", "--output", default=None, help="Output file (default: stdout)")
+@click.option(
+    "-f", "--format", "fmt", type=click.Choice(["ndjson", "csv"]), default="ndjson"
+)
+def export_users(output, fmt):
+    """Stream all users with their role names as NDJSON or CSV."""
+    from enferno.utils.export import USER_FIELDS, stream, user_rows
+
+    write_export(stream(user_rows(), USER_FIELDS, fmt), output)
+
+
+@users_cli.command("import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--update", is_flag=True, help="Update existing emails instead of skipping them"
+)
+@click.option(
+    "--create-roles", is_flag=True, help="Create roles the file names that don't exist"
+)
+@click.option("--batch-size", default=500, show_default=True)
+def import_csv(path, update, create_roles, batch_size):
+    """Import users from a CSV file in the `users export -f csv` format."""
+    from enferno.utils.user_import import import_users
+
+    stats = {}
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        try:
+            with console.status("Importing...") as status:
+                for stats in import_users(
+                    f,
+                    update_existing=update,
+                    batch_size=batch_size,
+                    create_roles=create_roles,
+                ):
+                    status.update(
+                        f"Imported {stats['created']:,} new, "
+                        f"{stats['updated']:,} updated, {stats['skipped']:,} skipped..."
+                    )
+        except ValueError as e:
+            raise click.ClickException(str(e)) from e
+
+    for error in stats.get("errors", []):
+        console.print(f"[red]✗[/] {error}")
+    console.print(
+        f"[green]✓[/] {stats.get('created', 0):,} created, "
+        f"{stats.get('updated', 0):,} updated, {stats.get('skipped', 0):,} skipped, "
+        f"{stats.get('failed', 0):,} failed"
+    )
+
+
+sessions_cli = AppGroup("sessions", help="Session record maintenance.")
+
+
+@sessions_cli.command()
+@click.option(
+    "--inactive-for",
+    default="30d",
+    show_default=True,
+    help="Also purge sessions idle this long, e.g. 30d, 4w, 12h",
+)
+@click.option("--batch-size", default=5000, show_default=True)
+def purge(inactive_for, batch_size):
+    """Delete logged out, expired and idle session records."""
+    from enferno.utils.archive import parse_duration
+    from enferno.utils.sessions import purge_sessions
+
+    try:
+        inactive_for = parse_duration(inactive_for)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--inactive-for") from e
+
+    total = 0
+    with console.status("Purging...") as status:
+        for count in purge_sessions(inactive_for, batch_size=batch_size):
+            total += count
+            status.update(f"Purged {total:,} sessions...")
+
+    console.print(f"[green]✓[/] Purged {total:,} sessions")
+
+
+passwords_cli = AppGroup("passwords", help="Password hash tuning.")
+
+
+@passwords_cli.command()
+@click.option("--target-ms", default=50, show_default=True, help="Latency budget")
+@click.option("--samples", default=3, show_default=True)
+def calibrate(target_ms, samples):
+    """Benchmark password hashing on this host and suggest a cost."""
+    from flask import current_app
+
+    from enferno.utils.hashing import calibrate as calibrate_rounds
+
+    scheme = current_app.config["SECURITY_PASSWORD_HASH"]
+    with console.status(f"Benchmarking {scheme}..."):
+        rounds, seconds, timings = calibrate_rounds(
+            scheme, target_ms / 1000, samples=samples
+        )
+
+    for measured, taken in timings:
+        console.print(f"  {scheme} rounds={measured}: {taken * 1000:.1f}ms")
+    console.print(
+        f"[green]✓[/] {scheme} at {rounds} rounds takes ~{seconds * 1000:.1f}ms "
+        f"(target {target_ms}ms). Set in .env:"
+    )
+    console.print(f"PASSWORD_HASH_ROUNDS={rounds}", highlight=False)
+
+
+@passwords_cli.command()
+def report():
+    """Show how many users are on each password scheme and cost."""
+    from rich.table import Table
+
+    from enferno.utils.hashing import hash_report
+
+    rows = hash_report()
+    table = Table("Scheme", "Rounds", "Users", "Status")
+    for scheme, rounds, users, outdated in rows:
+        if scheme is None:
+            status = "[dim]no password[/]"
+        else:
+            status = "[yellow]upgrade on login[/]" if outdated else "[green]current[/]"
+        table.add_row(scheme or "-", str(rounds or "-"), f"{users:,}", status)
+    console.print(table)
+
+    outdated = sum(users for _, _, users, old in rows if old)
+    total = sum(users for _, _, users, _ in rows)
+    console.print(f"{outdated:,} of {total:,} users still on an old scheme or cost")
+
+
+startup_cli = AppGroup("startup", help="Startup performance.")
+
+
+@startup_cli.command("profile")
+@click.option("--runs", default=3, show_default=True, help="Cold starts to measure")
+@click.option("--top", default=15, show_default=True, help="Packages to list")
+@click.option(
+    "--budget-ms",
+    default=None,
+    type=float,
+    help="Exit with an error if import plus create_app takes longer",
+)
+def profile_startup(runs, top, budget_ms):
+    """Measure cold start time and the packages it is spent in."""
+    from rich.table import Table
+
+    from enferno.utils.startup import boot_report
+
+    with console.status(f"Booting the app {runs} times..."):
+        report = boot_report(runs)
+
+    table = Table("Package", "Import ms")
+    for name, ms in report["packages"][:top]:
+        table.add_row(name, f"{ms:.1f}")
+    console.print(table)
+
+    total = report["import_ms"] + report["create_app_ms"]
+    console.print(
+        f"{report['modules']} modules; import {report['import_ms']:.0f}ms, "
+        f"create_app {report['create_app_ms']:.0f}ms (median of {runs}, "
+        "with importtime tracing)"
+    )
+    if budget_ms is not None and total > budget_ms:
+        raise click.ClickException(
+            f"Startup took {total:.0f}ms, over the {budget_ms:.0f}ms budget"
+        )
+    console.print(f"[green]✓[/] Startup took {total:.0f}ms")
+
+
+assets_cli = AppGroup("assets", help="Static asset builds.")
+
+
+@assets_cli.command("build")
+@click.option("--clean", is_flag=True, help="Remove earlier builds first")
+def build_assets(clean):
+    """Fingerprint and precompress static files, and write their manifest."""
+    from flask import current_app
+
+    from enferno.utils.assets import build
+    from enferno.utils.compression import BROTLI_AVAILABLE
+
+    directory = current_app.config["ASSETS_DIR"]
+    with console.status("Building static assets..."):
+        results = build(current_app.static_folder, directory, clean=clean)
+
+    size = sum(row[2] for row in results)
+    gzipped = sum(row[3] or row[2] for row in results)
+    console.print(
+        f"{len(results)} files, {size / 1024:.0f} KiB; "
+        f"{gzipped / 1024:.0f} KiB served gzipped"
+    )
+    if BROTLI_AVAILABLE:
+        brotli = sum(row[4] or row[2] for row in results)
+        console.print(f"{brotli / 1024:.0f} KiB served with brotli")
+    else:
+        console.print("[yellow]brotli is not installed; only .gz files written[/]")
+    console.print(f"[green]✓[/] Built into static/{directory}/ (restart to pick up)")
+
+
+templates_cli = AppGroup("templates", help="Template compilation.")
+
+
+@templates_cli.command("compile")
+def compile_all_templates():
+    """Compile every template into the bytecode cache."""
+    from time import perf_counter
+
+    from flask import current_app
+
+    from enferno.utils.templates import compile_templates
+
+    if not current_app.config.get("JINJA_BYTECODE_CACHE_DIR"):
+        raise click.ClickException("JINJA_BYTECODE_CACHE_DIR is not set")
+    # Already loaded at boot when TEMPLATES_PRELOAD is on; load them again
+    current_app.jinja_env.cache.clear()
+    started = perf_counter()
+    loaded, errors = compile_templates(current_app)
+    for name, error in errors:
+        console.print(f"[red]✗[/] {name}: {error}")
+    console.print(
+        f"[green]✓[/] {loaded} templates in "
+        f"{(perf_counter() - started) * 1000:.0f}ms, cached in "
+        f"{current_app.config['JINJA_BYTECODE_CACHE_DIR']}"
+    )
+    if errors:
+        raise click.ClickException(f"{len(errors)} templates failed to compile")
+
+
+tasks_cli = AppGroup("tasks", help="Background task tools.")
+
+
+@tasks_cli.command("benchmark")
+@click.option("-n", "--count", default=200, show_default=True, help="Tasks to run")
+def benchmark_tasks(count):
+    """Measure the per-task overhead of the Celery app context, in process."""
+    import time
+
+    from cachelib import SimpleCache
+
+    from enferno.tasks import celery
+
+    if celery is None:
+        raise click.ClickException("Celery is not installed or not configured")
+
+    from enferno.app import create_app
+    from enferno.settings import Config
+    from enferno.tasks import benchmark
+
+    def per_task(run):
+        started = time.perf_counter()
+        for _ in range(count):
+            run()
+        return (time.perf_counter() - started) / count * 1000
+
+    with console.status(f"Running {count} tasks..."):
+        benchmark.apply().get()  # warm up, and surface errors
+        shared = per_task(benchmark.apply)
+
+        # What every task used to cost: a whole new app per call. flask_session
+        # can define its SQLAlchemy table only once per process (so that setup
+        # failed from the second task on), hence in-memory sessions here
+        class PerTaskConfig(Config):
+            SESSION_TYPE = "cachelib"
+            SESSION_CACHELIB = SimpleCache()
+
+        def app_per_task():
+            with create_app(PerTaskConfig).app_context():
+                benchmark.run()
+
+        rebuilt = per_task(app_per_task)
+
+    console.print(f"  App per task:    {rebuilt:.2f}ms per task")
+    console.print(f"  App per worker:  {shared:.2f}ms per task")
+    console.print(f"[green]✓[/] {rebuilt / shared:.0f}x less overhead per task")
+
+
+mail_cli = AppGroup("mail", help="Outgoing mail.")
+
+
+@mail_cli.command()
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=1025, show_default=True)
+def serve(host, port):
+    """Run a local SMTP stand-in that prints what it receives.
+
+    Point the app at it with MAIL_SERVER=127.0.0.1 MAIL_PORT=1025
+    MAIL_USE_SSL=false.
+    """
+    from enferno.utils.mail import LocalSMTPServer
+
+    def show(sender, recipients, data):
+        subject = next(
+            (
+                line
+                for line in data.decode(errors="replace").splitlines()
+                if line.startswith("Subject:")
+            ),
+            "Subject: -",
+        )
+        console.print(f"[green]✓[/] {sender} → {', '.join(recipients)}  {subject}")
+
+    server = LocalSMTPServer(host, port, on_message=show)
+    console.print(f"SMTP stand-in listening on {server.host}:{server.port}")
+    server.serve_forever()
+
+
+@mail_cli.command("test")
+@click.argument("recipient")
+def send_test(recipient):
+    """Send a test message through the mail outbox."""
+    from flask import current_app
+
+    from enferno.extensions import outbox
+
+    if outbox.app is None:
+        raise click.ClickException("Mail is not configured (set MAIL_SERVER)")
+    outbox.send(
+        {
+            "subject": "Enferno test message",
+            "sender": current_app.config["SECURITY_EMAIL_SENDER"],
+            "recipients": [recipient],
+            "body": "Mail from Enferno is working.",
+        }
+    )
+    console.print(f"[green]✓[/] Queued a test message to {recipient}")
@@ -1,15 +1,25 @@
 """Extensions module. Each extension is initialized in the app factory located
-in app.py
+in app.py. Optional ones (mail, debug toolbar) are imported and created there,
+only when configured; send mail with outbox.send().
 """
 
 from flask_babel import Babel
 from flask_caching import Cache
-from flask_debugtoolbar import DebugToolbarExtension
-from flask_mail import Mail
 from flask_session import Session
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 
+from enferno.utils.assets import Assets
+from enferno.utils.audit import AuditWriter
+from enferno.utils.compression import Compression
+from enferno.utils.hashing import PasswordHasher
+from enferno.utils.identity import IdentityCache
+from enferno.utils.instrumentation import Instrumentation
+from enferno.utils.mail import MailOutbox
+from enferno.utils.metrics import Metrics
+from enferno.utils.roles import RoleRegistry
+from enferno.utils.sessions import SessionTracker
+
 
 class BaseModel(DeclarativeBase):
     pass
@@ -17,7 +27,15 @@ class BaseModel(DeclarativeBase):
 
 db = SQLAlchemy(model_class=BaseModel)
 cache = Cache()
-mail = Mail()
-debug_toolbar = DebugToolbarExtension()
 session = Session()
 babel = Babel()
+audit = AuditWriter()
+instrumentation = Instrumentation()
+metrics = Metrics()
+session_tracker = SessionTracker()
+hasher = PasswordHasher()
+outbox = MailOutbox()
+identity = IdentityCache()
+role_registry = RoleRegistry()
+assets = Assets()
+compression = Compression()
@@ -3,6 +3,7 @@ from flask.templating import render_template
 from flask_security import auth_required, current_user
 
 from enferno.user.models import Activity, Role, User
+from enferno.utils.counters import get_count
 
 portal = Blueprint("portal", __name__, static_folder="../static")
 
@@ -17,9 +18,10 @@ def before_request():
 def dashboard():
     stats = {}
     if current_user.has_role("admin"):
+        # Maintained counters; no COUNT(*) over the tables on page load
         stats = {
-            "users": User.query.count(),
-            "roles": Role.query.count(),
-            "activities": Activity.query.count(),
+            "users": get_count(User.__tablename__),
+            "roles": get_count(Role.__tablename__),
+            "activities": get_count(Activity.__tablename__),
         }
     return render_template("dashboard.html", stats=stats)
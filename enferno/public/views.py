@@ -10,9 +10,7 @@ from flask import (
     url_for,
 )
 from flask.templating import render_template
-from flask_dance.consumer import oauth_authorized, oauth_error
 from flask_security import current_user, login_user, logout_user
-from oauthlib.oauth2.rfc6749.errors import OAuth2Error
 from sqlalchemy.orm.exc import NoResultFound
 
 from enferno.extensions import db
@@ -52,7 +50,6 @@ def update_user_login_info(user, ip_address):
     user.current_login_ip = ip_address
     user.login_count = (user.login_count or 0) + 1
     db.session.add(user)
-    db.session.commit()
 
 
 def create_oauth_user(provider_data, oauth_token, ip_address):
@@ -137,8 +134,22 @@ def before_oauth_login():
 public.before_app_request(before_oauth_login)
 
 
-@oauth_authorized.connect
+def connect_oauth_signals():
+    """Connect the OAuth handlers below to Flask-Dance's signals.
+
+    Called by the app factory only when a provider is configured, so apps
+    without OAuth never import flask_dance and requests_oauthlib.
+    """
+    from flask_dance.consumer import oauth_authorized
+    from flask_dance.consumer import oauth_error as oauth_failed
+
+    oauth_authorized.connect(oauth_logged_in)
+    oauth_failed.connect(oauth_error)
+
+
 def oauth_logged_in(blueprint, token):
+    from oauthlib.oauth2.rfc6749.errors import OAuth2Error
+
     if not token:
         current_app.logger.error(
             f"OAuth login failed: No token received for {blueprint.name}"
@@ -169,6 +180,7 @@ def oauth_logged_in(blueprint, token):
                 logout_user()
             update_user_login_info(oauth.user, real_ip)
             login_user(oauth.user)
+            db.session.commit()
         else:
             # Check if user exists with this email
             existing_user = User.query.filter_by(
@@ -178,17 +190,19 @@ def oauth_logged_in(blueprint, token):
                 # Link OAuth to existing user
                 oauth.user = existing_user
                 db.session.add(oauth)
-                db.session.commit()
                 update_user_login_info(existing_user, real_ip)
                 login_user(existing_user)
+                db.session.commit()
                 flash("Account linked successfully.", category="success")
             else:
                 # Create new user
                 user = create_oauth_user(provider_data, token, real_ip)
                 oauth.user = user
                 db.session.add_all([user, oauth])
-                db.session.commit()
+                # The session record needs the user id; commit once, after login
+                db.session.flush()
                 login_user(user)
+                db.session.commit()
                 flash("Successfully signed in.")
 
         return redirect(url_for("portal.dashboard"))
@@ -199,7 +213,6 @@ def oauth_logged_in(blueprint, token):
         return False
 
 
-@oauth_error.connect
 def oauth_error(blueprint, message, response):
     current_app.logger.error(
         f"OAuth error from {blueprint.name}: {message}, Response: {response}"
@@ -2,7 +2,6 @@ import importlib.util
 import os
 from datetime import timedelta
 
-import bleach
 from dotenv import load_dotenv
 
 # Detect optional dependencies (installed via --extra full)
@@ -11,19 +10,20 @@ REDIS_AVAILABLE = importlib.util.find_spec("redis") is not None
 os_env = os.environ
 load_dotenv()
 
-# Session configuration - computed at module level
+# Session configuration - computed at module level. The redis client itself
+# is created by the app factory, so importing settings stays cheap
 _redis_url = os.environ.get("REDIS_URL") or os.environ.get("REDIS_SESSION")
 if REDIS_AVAILABLE and _redis_url:
-    import redis  # type: ignore[import-not-found]
-
     _SESSION_TYPE = "redis"
-    _SESSION_REDIS = redis.from_url(_redis_url)
 else:
     _SESSION_TYPE = "sqlalchemy"
-    _SESSION_REDIS = None
+    _redis_url = None
 
 
 def uia_email_mapper(identity):
+    # bleach pulls in html5lib, so it is imported on first sign-in, not at boot
+    import bleach
+
     # Sanitize and strip whitespace from email input
     return bleach.clean(identity, strip=True).strip() if identity else identity
 
@@ -36,7 +36,87 @@ class Config:
     PROJECT_ROOT = os.path.abspath(os.path.join(APP_DIR, os.pardir))
     DEBUG_TB_ENABLED = os.environ.get("DEBUG_TB_ENABLED")
     DEBUG_TB_INTERCEPT_REDIRECTS = False
-    CACHE_TYPE = "simple"  # Can be "memcached", "redis", etc.
+
+    # Two-tier cache: a per-process LRU of CACHE_LOCAL_SIZE entries, each kept
+    # at most CACHE_LOCAL_TTL seconds, in front of a SQLite file shared by the
+    # workers on this host. Writes are broadcast so other workers drop their
+    # local copy within CACHE_INVALIDATION_INTERVAL seconds. Setting
+    # CACHE_REDIS_URL opts in to Redis as the shared tier (with pub/sub
+    # invalidation); REDIS_URL alone doesn't switch it on
+    CACHE_TYPE = os.environ.get("CACHE_TYPE", "enferno.utils.cache.TieredCache")
+    CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL")
+    CACHE_SQLITE_PATH = os.environ.get(
+        "CACHE_SQLITE_PATH", os.path.join(PROJECT_ROOT, "instance", "cache.sqlite")
+    )
+    CACHE_LOCAL_SIZE = int(os.environ.get("CACHE_LOCAL_SIZE", 1024))
+    CACHE_LOCAL_TTL = int(os.environ.get("CACHE_LOCAL_TTL", 30))
+    CACHE_KEY_PREFIX = "cache:"
+    CACHE_INVALIDATION_INTERVAL = 0.5
+
+    # List API totals: cached COUNT(*) lifetime, and table size above which
+    # unfiltered lists report the planner's row estimate instead
+    PAGINATION_COUNT_TTL = int(os.environ.get("PAGINATION_COUNT_TTL", 60))
+    PAGINATION_ESTIMATE_THRESHOLD = int(
+        os.environ.get("PAGINATION_ESTIMATE_THRESHOLD", 100_000)
+    )
+
+    # Dashboard counters are maintained on writes and recounted in the
+    # background once older than this many seconds
+    COUNTER_RECONCILE_INTERVAL = int(os.environ.get("COUNTER_RECONCILE_INTERVAL", 900))
+
+    # Request instrumentation: slow request logging, plus an opt-in
+    # Server-Timing header sent only in debug mode or to admins
+    INSTRUMENTATION_ENABLED = (
+        os.environ.get("INSTRUMENTATION_ENABLED", "True").lower() == "true"
+    )
+    SERVER_TIMING_HEADER = (
+        os.environ.get("SERVER_TIMING_HEADER", "False").lower() == "true"
+    )
+    SLOW_REQUEST_MS = int(os.environ.get("SLOW_REQUEST_MS", 500))
+
+    # JSON, CSV and other text responses (not HTML, because of BREACH) of at
+    # least COMPRESS_MIN_SIZE bytes are brotli/gzip compressed on the fly.
+    # Static files are precompressed by `flask assets build`, into ASSETS_DIR
+    # under the static folder
+    COMPRESS_ENABLED = os.environ.get("COMPRESS_ENABLED", "True").lower() == "true"
+    COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+    ASSETS_DIR = "dist"
+
+    # Compiled templates are cached on disk and shared by all workers;
+    # `flask templates compile` fills the cache ahead of time. Outside debug
+    # mode every template is loaded at boot, so no request pays for it
+    JINJA_BYTECODE_CACHE_DIR = os.environ.get(
+        "JINJA_BYTECODE_CACHE_DIR", os.path.join(PROJECT_ROOT, "instance", "jinja")
+    )
+    TEMPLATES_PRELOAD = os.environ.get("TEMPLATES_PRELOAD", "True").lower() == "true"
+
+    # Prometheus metrics at /metrics, aggregated across workers through one
+    # file per process in METRICS_DIR (defaults to a temp directory). Scrapes
+    # need METRICS_TOKEN as a bearer token, or come from METRICS_ALLOWED_IPS
+    # (comma separated, empty by default: behind a local proxy every request
+    # looks like it comes from 127.0.0.1)
+    METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "True").lower() == "true"
+    METRICS_DIR = os.environ.get("METRICS_DIR")
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+    METRICS_ALLOWED_IPS = [
+        ip for ip in os.environ.get("METRICS_ALLOWED_IPS", "").split(",") if ip
+    ]
+
+    # Most create/update/delete operations accepted by one bulk API request
+    BULK_MAX_OPERATIONS = int(os.environ.get("BULK_MAX_OPERATIONS", 1000))
+
+    # Audit log writer: "request" flushes queued activities at app context
+    # teardown, "thread" from a background thread, "sync" writes immediately
+    AUDIT_WRITE_MODE = os.environ.get("AUDIT_WRITE_MODE", "request")
+    AUDIT_QUEUE_SIZE = 10000
+    AUDIT_BATCH_SIZE = 500
+    AUDIT_FLUSH_INTERVAL = 2.0
+    # Batches that fail while the database is unavailable are retried, then
+    # spooled to AUDIT_SPOOL_DIR (default instance/audit-spool) for `flask
+    # activities replay`; rows it rejects go to dead-letter files there
+    AUDIT_MAX_RETRIES = 3
+    AUDIT_RETRY_BACKOFF = 1.0
+    AUDIT_SPOOL_DIR = os.environ.get("AUDIT_SPOOL_DIR")
 
     # Database - default to SQLite in instance folder (absolute path)
     _default_db = f"sqlite:///{os.path.join(PROJECT_ROOT, 'instance', 'enferno.db')}"
@@ -55,10 +135,37 @@ class Config:
     SECURITY_CONFIRMABLE = False
     SECURITY_CHANGEABLE = True
     SECURITY_TRACKABLE = True
-    SECURITY_PASSWORD_HASH = "pbkdf2_sha512"
+    # Hashes in any other scheme, or below PASSWORD_HASH_ROUNDS, are upgraded
+    # on the user's next successful login. `flask passwords calibrate` picks
+    # the rounds (log2 cost for bcrypt) for a latency budget on this host.
+    # bcrypt defaults to cost 10 (~50-80ms a hash on a server core), the floor
+    # OWASP recommends; passlib's own default of 12 takes four times as long
+    SECURITY_PASSWORD_HASH = os.environ.get("SECURITY_PASSWORD_HASH", "bcrypt")
+    PASSWORD_HASH_ROUNDS = int(
+        os.environ.get(
+            "PASSWORD_HASH_ROUNDS", 10 if SECURITY_PASSWORD_HASH == "bcrypt" else 0
+        )
+    )
+    SECURITY_PASSWORD_HASH_PASSLIB_OPTIONS = (
+        {
+            f"{SECURITY_PASSWORD_HASH}__default_rounds": PASSWORD_HASH_ROUNDS,
+            f"{SECURITY_PASSWORD_HASH}__min_rounds": PASSWORD_HASH_ROUNDS,
+        }
+        if PASSWORD_HASH_ROUNDS
+        else {}
+    )
     SECURITY_PASSWORD_SALT = os.environ.get("SECURITY_PASSWORD_SALT")
     if not SECURITY_PASSWORD_SALT:
         raise ValueError("SECURITY_PASSWORD_SALT environment variable is required")
+
+    # Password hashing runs in a per-worker process pool (0 = the CPUs divided
+    # between the uwsgi workers).
+    # Calls beyond HASH_MAX_PENDING wait HASH_QUEUE_TIMEOUT seconds, then 503
+    HASH_POOL_ENABLED = os.environ.get("HASH_POOL_ENABLED", "True").lower() == "true"
+    HASH_POOL_SIZE = int(os.environ.get("HASH_POOL_SIZE", 0))
+    HASH_MAX_PENDING = int(os.environ.get("HASH_MAX_PENDING", 0))
+    HASH_QUEUE_TIMEOUT = float(os.environ.get("HASH_QUEUE_TIMEOUT", 5))
+
     SECURITY_USER_IDENTITY_ATTRIBUTES = [
         {"email": {"mapper": uia_email_mapper, "case_insensitive": True}},
     ]
@@ -94,7 +201,7 @@ class Config:
 
     # Session configuration - uses module-level computed values
     SESSION_TYPE = _SESSION_TYPE
-    SESSION_REDIS = _SESSION_REDIS
+    SESSION_REDIS_URL = _redis_url
     SESSION_SQLALCHEMY_TABLE = "sessions"
 
     SESSION_KEY_PREFIX = "session:"
@@ -108,6 +215,15 @@ class Config:
     )
     SESSION_COOKIE_SAMESITE = os.environ.get("SESSION_COOKIE_SAMESITE", "Lax")
 
+    # Session records: last_active is written at most once per interval
+    # (seconds) per session, in one batched UPDATE per worker
+    SESSION_TOUCH_INTERVAL = int(os.environ.get("SESSION_TOUCH_INTERVAL", 60))
+
+    # The signed-in user and their roles are cached for this many seconds
+    # (0 = off), and dropped as soon as that user, or any role or role grant,
+    # changes
+    IDENTITY_CACHE_TTL = int(os.environ.get("IDENTITY_CACHE_TTL", 60))
+
     # Session management
     DISABLE_MULTIPLE_SESSIONS = (
         os.environ.get("DISABLE_MULTIPLE_SESSIONS", "False").lower() == "true"
@@ -115,13 +231,25 @@ class Config:
 
     # flask mail settings
     MAIL_SERVER = os.environ.get("MAIL_SERVER")
-    MAIL_PORT = 465
-    MAIL_USE_SSL = True
+    MAIL_PORT = int(os.environ.get("MAIL_PORT", 465))
+    MAIL_USE_SSL = os.environ.get("MAIL_USE_SSL", "True").lower() == "true"
     MAIL_USERNAME = os.environ.get("MAIL_USERNAME")
     MAIL_PASSWORD = os.environ.get("MAIL_PASSWORD")
     SECURITY_EMAIL_SENDER = os.environ.get("SECURITY_EMAIL_SENDER", "info@domain.com")
     SECURITY_SEND_PASSWORD_CHANGE_EMAIL = False
 
+    # Outgoing mail is sent outside the request: by Celery when a broker is
+    # configured, else by a background thread per worker. Batches share one
+    # SMTP connection, closed after MAIL_IDLE_TIMEOUT idle seconds; transient
+    # failures are retried with exponential backoff from MAIL_RETRY_BACKOFF
+    MAIL_OUTBOX_MODE = os.environ.get(
+        "MAIL_OUTBOX_MODE", "celery" if CELERY_BROKER_URL else "thread"
+    )
+    MAIL_BATCH_SIZE = 50
+    MAIL_IDLE_TIMEOUT = 30
+    MAIL_MAX_RETRIES = int(os.environ.get("MAIL_MAX_RETRIES", 5))
+    MAIL_RETRY_BACKOFF = float(os.environ.get("MAIL_RETRY_BACKOFF", 2.0))
+
     # Google OAuth Settings
     GOOGLE_AUTH_ENABLED = (
         os.environ.get("GOOGLE_AUTH_ENABLED", "False").lower() == "true"
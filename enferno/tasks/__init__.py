@@ -1,5 +1,7 @@
 import importlib.util
 
+from flask import current_app, has_app_context
+
 # Detect optional dependencies
 CELERY_AVAILABLE = importlib.util.find_spec("celery") is not None
 
@@ -7,6 +9,7 @@ celery = None
 
 if CELERY_AVAILABLE:
     from celery import Celery  # type: ignore[import-not-found]
+    from celery.signals import worker_process_init  # type: ignore[import-not-found]
 
     from enferno.settings import Config as cfg
 
@@ -21,13 +24,40 @@ if CELERY_AVAILABLE:
 
         celery.conf.add_defaults(cfg)
 
+        # The Flask app of this worker process, built once on first use
+        _flask_app = None
+
+        def flask_app():
+            """The app tasks run in: the current one when a task is applied
+            eagerly from a request or CLI command, else this worker's own."""
+            global _flask_app
+            if has_app_context():
+                return current_app._get_current_object()
+            if _flask_app is None:
+                from enferno.app import create_app
+
+                _flask_app = create_app(cfg)
+            return _flask_app
+
+        @worker_process_init.connect
+        def init_worker_process(**kwargs):
+            """Build the app in each prefork child as it starts, not on its
+            first task. Connections a child inherited from the parent belong
+            to the parent, so they are dropped without being closed."""
+            from enferno.extensions import db
+
+            app = flask_app()
+            with app.app_context():
+                for engine in db.engines.values():
+                    engine.dispose(close=False)
+
         class ContextTask(celery.Task):
             abstract = True
 
             def __call__(self, *args, **kwargs):
-                from enferno.app import create_app
-
-                with create_app(cfg).app_context():
+                # A fresh app context per task; its teardown returns the DB
+                # session and flushes queued audit rows
+                with flask_app().app_context():
                     return super().__call__(*args, **kwargs)
 
         celery.Task = ContextTask
@@ -35,3 +65,25 @@ if CELERY_AVAILABLE:
         @celery.task
         def task():
             pass
+
+        @celery.task(bind=True)
+        def send_mail(self, messages):
+            """Send a batch of mail outbox messages over one SMTP connection."""
+            from enferno.extensions import outbox
+
+            failed = outbox.deliver(messages)
+            if not failed:
+                return
+            if self.request.retries >= outbox.max_retries:
+                outbox.drop(failed)
+                return
+            # Only the messages that failed are sent again
+            raise self.retry(
+                args=[failed],
+                countdown=outbox.backoff(self.request.retries),
+                max_retries=None,
+            )
+
+        @celery.task
+        def benchmark():
+            """No-op task for measuring per-task overhead (flask tasks benchmark)."""
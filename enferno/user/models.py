@@ -1,9 +1,8 @@
 import secrets
 import string
-from datetime import datetime
+from datetime import datetime, timedelta
 from uuid import uuid4
 
-from flask_dance.consumer.storage.sqla import OAuthConsumerMixin
 from flask_security import AsaList
 from flask_security.core import RoleMixin, UserMixin
 from flask_security.utils import hash_password
@@ -12,12 +11,15 @@ from sqlalchemy import (
     ForeignKey,
     Integer,
     Table,
+    event,
 )
-from sqlalchemy.ext.mutable import MutableList
+from sqlalchemy.ext.mutable import MutableDict, MutableList
 from sqlalchemy.orm import declared_attr, relationship
 
-from enferno.extensions import db
+from enferno.extensions import audit, db, role_registry
 from enferno.utils.base import BaseMixin
+from enferno.utils.roles import role_mask
+from enferno.utils.upsert import supports_upsert, upsert
 
 roles_users: Table = db.Table(
     "roles_users",
@@ -49,6 +51,8 @@ class User(UserMixin, db.Model, BaseMixin):
     name = db.Column(db.String(255), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
     email = db.Column(db.String(255), unique=True, nullable=False)
+    # Flask-Security and the CSV import look emails up case-insensitively
+    __table_args__ = (db.Index("ix_user_email_lower", db.func.lower(email)),)
     password = db.Column(db.String(255), nullable=False)
     password_set = db.Column(db.Boolean, default=True, nullable=False)
     active = db.Column(db.Boolean, default=False, nullable=True)
@@ -87,6 +91,20 @@ class User(UserMixin, db.Model, BaseMixin):
         """
         return self.password_set
 
+    @property
+    def role_mask(self):
+        """Bitmask of the user's role ids, computed once per loaded instance."""
+        mask = self.__dict__.get("_role_mask")
+        if mask is None:
+            mask = self.__dict__["_role_mask"] = role_mask(self.roles)
+        return mask
+
+    def has_role(self, role):
+        """Whether the user has `role` (a name or Role): one bit test, with
+        names resolved by the role registry."""
+        info = role_registry.get(role if isinstance(role, str) else role.id)
+        return info is not None and bool(self.role_mask & info.bit)
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -107,11 +125,7 @@ class User(UserMixin, db.Model, BaseMixin):
         # Update roles if specified, otherwise leave unchanged
         if "roles" in json_dict:
             role_ids = [r.get("id") for r in json_dict["roles"]]
-            self.roles = (
-                Role.query.filter(Role.id.in_(role_ids)).all()
-                if role_ids
-                else self.roles
-            )
+            self.roles = role_registry.instances(role_ids) if role_ids else self.roles
         self.active = json_dict.get("active", self.active)
         return self
 
@@ -139,11 +153,15 @@ class User(UserMixin, db.Model, BaseMixin):
         password = "".join(secrets.choice(alphabet) for i in range(length))
         return hash_password(password)
 
-    def logout_other_sessions(self, current_session_token=None):
+    def logout_other_sessions(self, current_session_token=None, commit=True):
         """Logout all other sessions for this user."""
+        from enferno.extensions import identity
         from enferno.user.models import Session
 
-        Session.deactivate_user_sessions(self.id, exclude_token=current_session_token)
+        Session.deactivate_user_sessions(
+            self.id, exclude_token=current_session_token, commit=commit
+        )
+        identity.forget(self)
 
     def get_active_sessions(self):
         """Get all active sessions for this user."""
@@ -165,6 +183,17 @@ class User(UserMixin, db.Model, BaseMixin):
         return devices
 
 
+@event.listens_for(User.roles, "append")
+@event.listens_for(User.roles, "remove")
+@event.listens_for(User, "expire")
+@event.listens_for(User, "refresh")
+def _forget_role_mask(target, *args):
+    # Recomputed from the roles on next use. expire_all() also reports
+    # instances that were garbage collected, as None
+    if target is not None:
+        target.__dict__.pop("_role_mask", None)
+
+
 class WebAuthn(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     credential_id = db.Column(
@@ -196,8 +225,14 @@ class WebAuthn(db.Model):
         return {"fs_webauthn_user_handle": self.user_id}
 
 
-class OAuth(OAuthConsumerMixin, db.Model):
+class OAuth(db.Model):
+    # The columns of flask_dance's OAuthConsumerMixin, declared here so the
+    # models don't import flask_dance when OAuth is not configured
     __tablename__ = "oauth"
+    id = db.Column(db.Integer, primary_key=True)
+    provider = db.Column(db.String(50), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    token = db.Column(MutableDict.as_mutable(db.JSON), nullable=False)
     provider_user_id = db.Column(db.String(256), unique=True, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey(User.id), nullable=False)
     user = db.relationship(
@@ -209,25 +244,79 @@ class OAuth(OAuthConsumerMixin, db.Model):
 
 
 class Activity(db.Model, BaseMixin):
+    # Keyset pagination seeks on (created_at, id), newest first. Each filter
+    # combination (user, action, both) gets an index with the same suffix so a
+    # date range plus ordering is always a single index range scan.
+    __table_args__ = (
+        db.Index("ix_activity_created_at_id", "created_at", "id"),
+        db.Index("ix_activity_user_created_at_id", "user_id", "created_at", "id"),
+        db.Index("ix_activity_action_created_at_id", "action", "created_at", "id"),
+        db.Index(
+            "ix_activity_user_action_created_at_id",
+            "user_id",
+            "action",
+            "created_at",
+            "id",
+        ),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, nullable=False)
     action = db.Column(db.String(255), nullable=False)
     data = db.Column(db.JSON, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
 
+    @classmethod
+    def filters(cls, args):
+        """Build WHERE clauses from `user_id`, `action`, `date_from` and `date_to`.
+
+        Dates are ISO dates or datetimes; a bare `date_to` date includes that
+        whole day. Every combination is covered by one of the indexes above.
+        Raises ValueError for malformed values.
+        """
+        filters = []
+        if args.get("user_id"):
+            filters.append(cls.user_id == int(args["user_id"]))
+        if args.get("action"):
+            filters.append(cls.action == args["action"])
+        if args.get("date_from"):
+            filters.append(cls.created_at >= datetime.fromisoformat(args["date_from"]))
+        if args.get("date_to"):
+            date_to = datetime.fromisoformat(args["date_to"])
+            if len(args["date_to"]) == 10:
+                filters.append(cls.created_at < date_to + timedelta(days=1))
+            else:
+                filters.append(cls.created_at <= date_to)
+        return filters
+
     @classmethod
     def register(cls, user_id, action, data=None):
-        """Register an activity for audit purposes."""
-        activity = cls(user_id=user_id, action=action, data=data)
-        db.session.add(activity)
-        db.session.commit()
-        return activity
+        """Register an activity for audit purposes.
+
+        The row is queued on the audit writer and inserted in a batch on its own
+        connection, so this neither commits nor waits on the caller's session.
+        """
+        audit.enqueue(
+            {
+                "user_id": user_id,
+                "action": action,
+                "data": data,
+                "created_at": datetime.now(),
+            }
+        )
 
 
 class Session(db.Model, BaseMixin):
     """Track active user sessions for session management."""
 
     __tablename__ = "user_sessions"
+    __table_args__ = (
+        # deactivate_user_sessions and the active sessions list
+        db.Index("ix_user_sessions_user_id_is_active", "user_id", "is_active"),
+        # purge_sessions: logged out or idle, and expired
+        db.Index("ix_user_sessions_is_active_last_active", "is_active", "last_active"),
+        db.Index("ix_user_sessions_expires_at", "expires_at"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
@@ -258,39 +347,46 @@ class Session(db.Model, BaseMixin):
 
     @classmethod
     def create_session(cls, user_id, session_token, ip_address=None, meta=None):
-        """Create or update a session for a user.
+        """Create or update a session for a user, without committing.
 
-        Uses get-or-create pattern to avoid unique constraint violations
-        that would rollback other pending changes (like password updates).
+        On Postgres and SQLite this is one INSERT ... ON CONFLICT (session_token)
+        DO UPDATE, so there is no SELECT first and a reused token can't raise a
+        unique constraint violation that would roll back other pending changes
+        (like password updates). Other databases fall back to get-or-create.
         """
-        # Try to find existing session first
+        now = datetime.now()
+        values = {
+            "user_id": user_id,
+            "ip_address": ip_address,
+            "meta": meta,
+            "is_active": True,
+            "last_active": now,
+        }
+        if supports_upsert():
+            db.session.execute(
+                upsert(
+                    cls.__table__,
+                    {**values, "session_token": session_token, "created_at": now},
+                    index_elements=[cls.session_token],
+                    update=values,
+                )
+            )
+            return
+
         existing = cls.query.filter_by(session_token=session_token).first()
         if existing:
-            # Update existing session
-            existing.user_id = user_id
-            existing.ip_address = ip_address
-            existing.meta = meta
-            existing.is_active = True
-            existing.last_active = datetime.now()
+            for key, value in values.items():
+                setattr(existing, key, value)
             db.session.add(existing)
-            return existing
-
-        # Create new session
-        session_record = cls(
-            user_id=user_id,
-            session_token=session_token,
-            ip_address=ip_address,
-            meta=meta,
-            is_active=True,
-        )
-        db.session.add(session_record)
-        return session_record
+        else:
+            db.session.add(cls(session_token=session_token, **values))
 
     @classmethod
-    def deactivate_user_sessions(cls, user_id, exclude_token=None):
+    def deactivate_user_sessions(cls, user_id, exclude_token=None, commit=True):
         """Deactivate all sessions for a user, optionally excluding current."""
         query = cls.query.filter_by(user_id=user_id, is_active=True)
         if exclude_token:
             query = query.filter(cls.session_token != exclude_token)
-        query.update({"is_active": False})
-        db.session.commit()
+        query.update({"is_active": False}, synchronize_session=False)
+        if commit:
+            db.session.commit()
@@ -1,7 +1,15 @@
 import datetime
 
 import orjson as json
-from flask import Blueprint, Response, current_app, render_template, request, session
+from flask import (
+    Blueprint,
+    Response,
+    current_app,
+    render_template,
+    request,
+    session,
+    stream_with_context,
+)
 from flask_login import user_logged_out
 from flask_security import auth_required, current_user, roles_required
 from flask_security.signals import (
@@ -9,13 +17,27 @@ from flask_security.signals import (
     tf_profile_changed,
     user_authenticated,
 )
-
-from enferno.extensions import db
-from enferno.user.models import Activity, Role, Session, User
+from sqlalchemy.orm import selectinload
+
+from enferno.extensions import db, role_registry
+from enferno.user.models import Activity, Role, Session, User, roles_users
+from enferno.utils.bulk import bulk_roles, bulk_users, parse_operations
+from enferno.utils.export import (
+    ACTIVITY_FIELDS,
+    FORMATS,
+    USER_FIELDS,
+    activity_rows,
+    stream,
+    user_rows,
+)
+from enferno.utils.pagination import encode_cursor, keyset_paginate, paginate
+from enferno.utils.versions import conditional
 
 bp_user = Blueprint("users", __name__, static_folder="../static")
 
 PER_PAGE = 25
+# Same bound db.paginate applies through its max_per_page default
+MAX_PER_PAGE = 100
 
 
 @bp_user.before_request
@@ -27,21 +49,22 @@ def before_request():
 
 @bp_user.route("/users/")
 def users():
-    roles = Role.query.all()
-    roles = [r.to_dict() for r in roles]
+    roles = [r._asdict() for r in role_registry.all()]
     return render_template("cms/users.html", roles=roles)
 
 
 @bp_user.route("/api/users")
+@conditional(User.__tablename__, Role.__tablename__, roles_users.name)
 def api_user():
     page = request.args.get("page", 1, type=int)
     per_page = request.args.get("per_page", PER_PAGE, type=int)
 
-    # Start with base query - this pattern makes it easy to add filters later
-    query = db.select(User)
+    # Start with base query - this pattern makes it easy to add filters later.
+    # Roles are fetched for the whole page in one IN query instead of per user.
+    query = db.select(User).options(selectinload(User.roles))
 
     # Paginate results
-    pagination = db.paginate(query, page=page, per_page=per_page)
+    pagination = paginate(query, page=page, per_page=per_page)
 
     # Convert users to dictionaries
     items = [user.to_dict() for user in pagination.items]
@@ -50,6 +73,7 @@ def api_user():
     response_data = {
         "items": items,
         "total": pagination.total,
+        "totalIsEstimate": pagination.total_is_estimate,
         "perPage": pagination.per_page,
     }
 
@@ -100,12 +124,31 @@ def api_user_delete(id):
     return {"message": "User successfully deleted!"}
 
 
+@bp_user.post("/api/users/bulk")
+def api_users_bulk():
+    try:
+        operations = parse_operations(request.get_json(silent=True))
+    except ValueError as e:
+        return {"message": str(e)}, 400
+    return bulk_response(bulk_users(operations, current_user.id))
+
+
+def bulk_response(results):
+    failed = sum(not result["ok"] for result in results)
+    return {
+        "message": f"{len(results) - failed} of {len(results)} operations applied",
+        "failed": failed,
+        "results": results,
+    }
+
+
 @bp_user.route("/roles/")
 def roles():
     return render_template("cms/roles.html")
 
 
 @bp_user.route("/api/roles", methods=["GET"])
+@conditional(Role.__tablename__)
 def api_roles():
     page = request.args.get("page", 1, type=int)
     per_page = request.args.get("per_page", PER_PAGE, type=int)
@@ -114,7 +157,7 @@ def api_roles():
     query = db.select(Role)
 
     # Paginate results
-    pagination = db.paginate(query, page=page, per_page=per_page)
+    pagination = paginate(query, page=page, per_page=per_page)
 
     # Convert roles to dictionaries
     items = [role.to_dict() for role in pagination.items]
@@ -123,6 +166,7 @@ def api_roles():
     response_data = {
         "items": items,
         "total": pagination.total,
+        "totalIsEstimate": pagination.total_is_estimate,
         "perPage": pagination.per_page,
     }
 
@@ -172,43 +216,152 @@ def api_role_delete(id):
     return {"message": "Role successfully deleted!"}
 
 
+@bp_user.post("/api/roles/bulk")
+def api_roles_bulk():
+    try:
+        operations = parse_operations(request.get_json(silent=True))
+    except ValueError as e:
+        return {"message": str(e)}, 400
+    return bulk_response(bulk_roles(operations, current_user.id))
+
+
 @bp_user.route("/activities/")
 def activities():
     return render_template("cms/activities.html")
 
 
+def activity_to_dict(activity, user):
+    """Serialize an (Activity, User) row from the activities join."""
+    return {
+        "id": activity.id,
+        "user_id": activity.user_id,
+        "user": user.display_name if user else f"User ID: {activity.user_id}",
+        "action": activity.action,
+        "data": activity.data,
+        "created_at": activity.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+@bp_user.route("/api/activities/export")
+def api_activities_export():
+    """Stream filtered activities as NDJSON (default) or CSV (`format=csv`)."""
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in FORMATS:
+        return {"message": "Unsupported format"}, 400
+    try:
+        filters = Activity.filters(request.args)
+    except ValueError:
+        return {"message": "Invalid filter value"}, 400
+
+    Activity.register(
+        current_user.id, "Activities Export", {**request.args.to_dict(), "format": fmt}
+    )
+    return export_response(
+        stream(activity_rows(filters), ACTIVITY_FIELDS, fmt), "activities", fmt
+    )
+
+
+@bp_user.route("/api/users/export")
+def api_users_export():
+    """Stream all users as NDJSON (default) or CSV (`format=csv`)."""
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in FORMATS:
+        return {"message": "Unsupported format"}, 400
+
+    Activity.register(current_user.id, "Users Export", {"format": fmt})
+    return export_response(stream(user_rows(), USER_FIELDS, fmt), "users", fmt)
+
+
+def export_response(chunks, name, fmt):
+    filename = f"{name}-{datetime.date.today().isoformat()}.{fmt}"
+    return Response(
+        stream_with_context(chunks),
+        content_type=FORMATS[fmt],
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}",
+            # Let nginx pass chunks straight through instead of buffering them
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
 @bp_user.route("/api/activities")
+@conditional(Activity.__tablename__, User.__tablename__)
 def api_activities():
+    """List activities, newest first, optionally filtered (see Activity.filters).
+
+    Passing `after` or `before` (empty for the first page) switches to cursor
+    mode, which seeks by (created_at, id) instead of scanning past an OFFSET.
+    Without them the classic `page`/`per_page` contract is used.
+    """
     page = request.args.get("page", 1, type=int)
     per_page = request.args.get("per_page", PER_PAGE, type=int)
 
+    try:
+        filters = Activity.filters(request.args)
+    except ValueError:
+        return {"message": "Invalid filter value"}, 400
+
     # Join with User to avoid N+1 queries
     query = (
         db.select(Activity, User)
         .outerjoin(User, Activity.user_id == User.id)
-        .order_by(Activity.created_at.desc())
+        .where(*filters)
     )
 
-    # Paginate results
-    pagination = db.paginate(query, page=page, per_page=per_page)
+    if "after" in request.args or "before" in request.args:
+        per_page = min(max(per_page, 1), MAX_PER_PAGE)
+        try:
+            rows, has_older, has_newer = keyset_paginate(
+                query,
+                Activity.created_at,
+                Activity.id,
+                per_page,
+                after=request.args.get("after"),
+                before=request.args.get("before"),
+            )
+        except ValueError:
+            return {"message": "Invalid cursor"}, 400
+
+        first, last = (rows[0][0], rows[-1][0]) if rows else (None, None)
+        response_data = {
+            "items": [activity_to_dict(activity, user) for activity, user in rows],
+            "perPage": per_page,
+            "nextCursor": encode_cursor(last.created_at, last.id)
+            if has_older and last
+            else None,
+            "prevCursor": encode_cursor(first.created_at, first.id)
+            if has_newer and first
+            else None,
+        }
+        return Response(json.dumps(response_data), content_type="application/json")
+
+    # db.paginate only returns the first entity of each row, so page over
+    # activities and resolve their users with a single IN query
+    query = (
+        db.select(Activity)
+        .where(*filters)
+        .order_by(Activity.created_at.desc(), Activity.id.desc())
+    )
+    pagination = paginate(query, page=page, per_page=per_page)
+
+    user_ids = {activity.user_id for activity in pagination.items}
+    users = {
+        user.id: user
+        for user in db.session.scalars(db.select(User).where(User.id.in_(user_ids)))
+    }
 
     # Convert activities to dictionaries
-    items = []
-    for activity, user in pagination.items:
-        items.append(
-            {
-                "id": activity.id,
-                "user": user.display_name if user else f"User ID: {activity.user_id}",
-                "action": activity.action,
-                "data": activity.data,
-                "created_at": activity.created_at.strftime("%Y-%m-%d %H:%M:%S"),
-            }
-        )
+    items = [
+        activity_to_dict(activity, users.get(activity.user_id))
+        for activity in pagination.items
+    ]
 
     # Create consistent response structure with metadata
     response_data = {
         "items": items,
         "total": pagination.total,
+        "totalIsEstimate": pagination.total_is_estimate,
         "perPage": pagination.per_page,
     }
 
@@ -220,7 +373,12 @@ def api_activities():
 
 @user_authenticated.connect
 def user_authenticated_handler(app, user, authn_via, **extra_args):
-    """Handle user authentication - create session record and check for new IP."""
+    """Handle user authentication - create session record and check for new IP.
+
+    Nothing here commits: the session upsert, other-session logout and
+    Flask-Security's trackable columns all go out in the login view's single
+    commit, and the activity row is written by the audit queue.
+    """
     session_data = {
         "user_id": user.id,
         "session_token": session.sid if hasattr(session, "sid") else str(id(session)),
@@ -246,7 +404,7 @@ def user_authenticated_handler(app, user, authn_via, **extra_args):
 
     # Enforce single session if configured
     if current_app.config.get("DISABLE_MULTIPLE_SESSIONS", False):
-        user.logout_other_sessions(session_data["session_token"])
+        user.logout_other_sessions(session_data["session_token"], commit=False)
 
 
 @password_changed.connect
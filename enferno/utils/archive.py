@@ -0,0 +1,287 @@
+import gzip
+import os
+import re
+from datetime import date, datetime, timedelta
+
+import orjson as json
+from sqlalchemy import delete, select, tuple_
+
+from enferno.extensions import db
+from enferno.user.models import Activity
+from enferno.utils.counters import adjust
+
+DURATION_UNITS = {"h": "hours", "d": "days", "w": "weeks"}
+# How long the partition swap waits for its exclusive lock before giving up,
+# rather than queueing every activity insert behind a long-running query
+LOCK_TIMEOUT = "5s"
+
+
+def parse_duration(value):
+    """Parse a duration such as "90d", "12w" or "36h" into a timedelta."""
+    match = re.fullmatch(r"(\d+)([hdw])", value.strip().lower())
+    if not match:
+        raise ValueError(f"Invalid duration {value!r}, expected e.g. 90d, 12w, 36h")
+    amount, unit = match.groups()
+    return timedelta(**{DURATION_UNITS[unit]: int(amount)})
+
+
+def archive_activities(cutoff, out_dir, batch_size=5000, delete_rows=True):
+    """Move activities older than `cutoff` into gzipped JSONL files, one per day.
+
+    Rows are read in (created_at, id) order with a keyset cursor, appended to
+    `out_dir/activities-YYYY-MM-DD.jsonl.gz`, and then deleted by primary key
+    in the same batch, so each transaction only holds locks on `batch_size`
+    rows. A crash between writing and deleting a batch can duplicate at most
+    that batch in the archive; it never loses rows.
+
+    Yields the number of rows handled after each batch, for progress reporting.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    table = Activity.__table__
+    key = tuple_(table.c.created_at, table.c.id)
+    last = None
+    shard_day, shard = None, None
+
+    try:
+        while True:
+            query = select(table).where(table.c.created_at < cutoff)
+            if last is not None:
+                query = query.where(key > last)
+            query = query.order_by(table.c.created_at, table.c.id).limit(batch_size)
+            rows = db.session.execute(query).mappings().all()
+            if not rows:
+                break
+
+            for row in rows:
+                day = row["created_at"].date()
+                if day != shard_day:
+                    if shard is not None:
+                        shard.close()
+                    # Append so re-runs and cutoffs that split a day extend the shard
+                    shard_day = day
+                    shard = gzip.open(
+                        os.path.join(out_dir, f"activities-{day.isoformat()}.jsonl.gz"),
+                        "ab",
+                    )
+                shard.write(json.dumps(dict(row), option=json.OPT_APPEND_NEWLINE))
+            shard.flush()
+
+            last = (rows[-1]["created_at"], rows[-1]["id"])
+            if delete_rows:
+                ids = [row["id"] for row in rows]
+                db.session.execute(delete(table).where(table.c.id.in_(ids)))
+            db.session.commit()
+            if delete_rows:
+                adjust(table.name, -len(rows))
+            yield len(rows)
+    finally:
+        if shard is not None:
+            shard.close()
+
+    if delete_rows and is_partitioned():
+        drop_partitions_before(cutoff)
+
+
+def is_partitioned():
+    """True if the activity table is a Postgres partitioned table."""
+    if db.engine.dialect.name != "postgresql":
+        return False
+    relkind = db.session.execute(
+        db.text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:t)"),
+        {"t": Activity.__tablename__},
+    ).scalar()
+    return relkind == "p"
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def next_month(value):
+    return date(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+def partition_activities(months_ahead=3):
+    """Convert activity to monthly range partitions on created_at (Postgres only).
+
+    On the first run the existing table is renamed to `activity_legacy` and
+    attached as the partition holding everything before the next month
+    boundary, so no rows are copied. The unique (id, created_at) index and the
+    range check that ATTACH PARTITION needs are built beforehand without
+    blocking writes (see _prepare_legacy), so the swap itself only holds an
+    ACCESS EXCLUSIVE lock on activity for catalog changes, typically well
+    under a second; it gives up after LOCK_TIMEOUT if it can't get the lock.
+    Every run then creates partitions up to
+    `months_ahead` months from now, plus a default partition so inserts never
+    fail. Run it from cron or a scheduled task to keep partitions ahead of time.
+
+    Returns the names of the partitions created.
+    """
+    table = Activity.__tablename__
+    created = []
+
+    if not is_partitioned():
+        boundary = db.session.execute(
+            db.text(f"SELECT max(created_at) FROM {table}")
+        ).scalar()
+        boundary = next_month(boundary or datetime.now())
+        # CREATE INDEX CONCURRENTLY waits for open transactions, this one included
+        db.session.commit()
+        _prepare_legacy(table, boundary)
+
+        db.session.execute(db.text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+        # Free the model's index names for the new parent table
+        db.session.execute(db.text(f"ALTER TABLE {table} RENAME TO {table}_legacy"))
+        db.session.execute(
+            db.text(
+                f"ALTER TABLE {table}_legacy RENAME CONSTRAINT {table}_pkey "
+                f"TO {table}_legacy_pkey"
+            )
+        )
+        for index in Activity.__table__.indexes:
+            db.session.execute(
+                db.text(
+                    f"ALTER INDEX IF EXISTS {index.name} RENAME TO {index.name}_legacy"
+                )
+            )
+        # ATTACH only reuses a child index for the parent's primary key if it
+        # backs a constraint; this is a catalog change, the index already exists
+        db.session.execute(
+            db.text(
+                f"ALTER TABLE {table}_legacy ADD CONSTRAINT {table}_legacy_part_key "
+                f"UNIQUE USING INDEX {table}_legacy_part_key"
+            )
+        )
+
+        db.session.execute(
+            db.text(
+                f"CREATE TABLE {table} (LIKE {table}_legacy INCLUDING DEFAULTS) "
+                f"PARTITION BY RANGE (created_at)"
+            )
+        )
+        # Unique constraints on a partitioned table must include the partition key
+        db.session.execute(
+            db.text(f"ALTER TABLE {table} ADD PRIMARY KEY (id, created_at)")
+        )
+        for index in Activity.__table__.indexes:
+            index.create(db.session.connection())
+        db.session.execute(
+            db.text(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+        )
+        db.session.execute(
+            db.text(
+                f"ALTER TABLE {table} ATTACH PARTITION {table}_legacy "
+                f"FOR VALUES FROM (MINVALUE) TO ('{boundary.isoformat()}')"
+            )
+        )
+        # The partition bound now enforces the same range
+        db.session.execute(
+            db.text(f"ALTER TABLE {table}_legacy DROP CONSTRAINT {table}_legacy_bound")
+        )
+        start = boundary
+    else:
+        start = month_start(datetime.now())
+
+    end = month_start(datetime.now())
+    for _ in range(months_ahead + 1):
+        end = next_month(end)
+
+    while start < end:
+        name = f"{table}_{start:%Y_%m}"
+        exists = db.session.execute(
+            db.text("SELECT to_regclass(:t)"), {"t": name}
+        ).scalar()
+        if not exists:
+            db.session.execute(
+                db.text(
+                    f"CREATE TABLE {name} PARTITION OF {table} "
+                    f"FOR VALUES FROM ('{start.isoformat()}') "
+                    f"TO ('{next_month(start).isoformat()}')"
+                )
+            )
+            created.append(name)
+        start = next_month(start)
+
+    db.session.execute(
+        db.text(
+            f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"
+        )
+    )
+    db.session.commit()
+    return created
+
+
+def _prepare_legacy(table, boundary):
+    """Do ATTACH PARTITION's slow work on the live table without blocking writes.
+
+    Attaching needs a unique index on (id, created_at) to match the parent's
+    primary key, and proof that every row falls below `boundary`. Without them
+    it builds the index and scans the whole table under an exclusive lock.
+    Here the index is built CONCURRENTLY and the range is proven by a CHECK
+    constraint added NOT VALID (instant) and then validated, which only takes
+    a SHARE UPDATE EXCLUSIVE lock, so inserts carry on throughout.
+    """
+    index = f"{table}_legacy_part_key"
+    check = f"{table}_legacy_bound"
+    engine = db.engine.execution_options(isolation_level="AUTOCOMMIT")
+    with engine.connect() as conn:
+        valid = conn.execute(
+            db.text(
+                "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:i)"
+            ),
+            {"i": index},
+        ).scalar()
+        if valid is False:
+            # Left behind by an interrupted concurrent build
+            conn.execute(db.text(f"DROP INDEX CONCURRENTLY {index}"))
+        conn.execute(
+            db.text(
+                f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {index} "
+                f"ON {table} (id, created_at)"
+            )
+        )
+
+        # Adding and dropping the constraint still take a brief exclusive lock
+        conn.execute(db.text(f"SET lock_timeout = '{LOCK_TIMEOUT}'"))
+        conn.execute(db.text(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {check}"))
+        conn.execute(
+            db.text(
+                f"ALTER TABLE {table} ADD CONSTRAINT {check} "
+                f"CHECK (created_at < '{boundary.isoformat()}') NOT VALID"
+            )
+        )
+        conn.execute(db.text("RESET lock_timeout"))
+        conn.execute(db.text(f"ALTER TABLE {table} VALIDATE CONSTRAINT {check}"))
+
+
+def drop_partitions_before(cutoff):
+    """Drop monthly partitions whose whole range is older than `cutoff`.
+
+    archive_activities has already exported and deleted their rows, so this
+    only reclaims the empty tables (and their bloat) instantly.
+    """
+    table = Activity.__tablename__
+    partitions = (
+        db.session.execute(
+            db.text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = to_regclass(:t)"
+            ),
+            {"t": table},
+        )
+        .scalars()
+        .all()
+    )
+
+    for name in partitions:
+        match = re.fullmatch(rf"{table}_(\d{{4}})_(\d{{2}})", name)
+        if not match:
+            continue
+        upper = next_month(date(int(match[1]), int(match[2]), 1))
+        if upper > cutoff.date():
+            continue
+        has_rows = db.session.execute(db.text(f"SELECT 1 FROM {name} LIMIT 1")).first()
+        if not has_rows:
+            db.session.execute(db.text(f"DROP TABLE {name}"))
+    db.session.commit()
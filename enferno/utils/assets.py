@@ -0,0 +1,170 @@
+import hashlib
+import os
+import posixpath
+import re
+import shutil
+
+import orjson as json
+from flask import request, url_for
+
+from enferno.utils.compression import BROTLI_AVAILABLE, compress
+
+MANIFEST = "manifest.json"
+
+# A year, the longest lifetime caches honour
+IMMUTABLE_MAX_AGE = 31536000
+
+# Text formats; images and woff fonts are compressed already
+COMPRESSIBLE = {".css", ".js", ".json", ".svg", ".txt", ".ico", ".ttf", ".eot"}
+
+# Build outputs and source maps (not needed by browsers) aren't fingerprinted
+SKIPPED = {".gz", ".br", ".map"}
+
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+# The source map comment, which has to end the file; the maps aren't built
+SOURCE_MAP_URL = re.compile(
+    rb"(?:^|\n)[ \t]*(?://[#@] sourceMappingURL=\S*|/\*[#@] sourceMappingURL=[^*]*\*/)"
+    rb"\s*\Z"
+)
+
+
+def fingerprint(path, data):
+    """`css/app.css` -> `css/app.<content hash>.css`."""
+    stem, ext = posixpath.splitext(path)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+
+def rewrite_css_urls(css, path, manifest):
+    """Point relative url() references in the stylesheet at `path` to their
+    fingerprinted builds, keeping any ?query or #fragment."""
+
+    def replace(match):
+        quote, url = match.groups()
+        if url.startswith(("data:", "http:", "https:", "//", "/", "#")):
+            return match.group(0)
+        target, sep, rest = (re.split(r"([?#])", url, maxsplit=1) + ["", ""])[:3]
+        resolved = posixpath.normpath(posixpath.join(posixpath.dirname(path), target))
+        built = manifest.get(resolved)
+        if built is None:
+            return match.group(0)
+        relative = posixpath.relpath(built, posixpath.dirname(path))
+        return f"url({quote}{relative}{sep}{rest}{quote})"
+
+    return CSS_URL.sub(replace, css)
+
+
+def build(static_folder, directory="dist", clean=False):
+    """Fingerprint everything under `static_folder` into `directory` inside it.
+
+    Each file is copied as name.<hash>.ext, next to .gz and (with the brotli
+    package installed) .br versions for text formats, which nginx can serve
+    as they are with gzip_static / brotli_static. Source maps aren't built,
+    so the comments pointing at them are removed. Stylesheets are built last
+    so their url() references can point at the fingerprinted fonts and
+    images. The mapping from source to build is written to
+    `directory`/manifest.json.
+
+    Builds are content addressed, so files from earlier builds are kept for
+    pages still referencing them unless `clean` is set.
+
+    Returns a list of (source, build, size, gzip_size, brotli_size) tuples;
+    the compressed sizes are None when no such file was written.
+    """
+    out = os.path.join(static_folder, directory)
+    if clean and os.path.isdir(out):
+        shutil.rmtree(out)
+
+    sources = []
+    for root, dirs, files in os.walk(static_folder):
+        if os.path.abspath(root) == os.path.abspath(static_folder):
+            dirs[:] = [d for d in dirs if d != directory]
+        for name in files:
+            if posixpath.splitext(name)[1] not in SKIPPED:
+                path = os.path.relpath(os.path.join(root, name), static_folder)
+                sources.append(path.replace(os.sep, "/"))
+    sources.sort(key=lambda path: (path.endswith(".css"), path))
+
+    manifest, results = {}, []
+    for path in sources:
+        with open(os.path.join(static_folder, path), "rb") as f:
+            data = f.read()
+        if path.endswith((".css", ".js")):
+            # Otherwise browsers with devtools open request the map and get a 404
+            data = SOURCE_MAP_URL.sub(b"\n", data)
+        if path.endswith(".css"):
+            data = rewrite_css_urls(data.decode(), path, manifest).encode()
+
+        built = manifest[path] = fingerprint(path, data)
+        target = os.path.join(out, built)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as f:
+            f.write(data)
+
+        sizes = []
+        for encoding, suffix in (("gzip", ".gz"), ("br", ".br")):
+            size = None
+            if posixpath.splitext(path)[1] in COMPRESSIBLE and (
+                encoding == "gzip" or BROTLI_AVAILABLE
+            ):
+                compressed = compress(data, encoding, best=True)
+                # Only worth serving when it is actually smaller
+                if len(compressed) < len(data):
+                    with open(target + suffix, "wb") as f:
+                        f.write(compressed)
+                    size = len(compressed)
+            sizes.append(size)
+        results.append((path, built, len(data), *sizes))
+
+    with open(os.path.join(out, MANIFEST), "wb") as f:
+        f.write(json.dumps(manifest, option=json.OPT_INDENT_2 | json.OPT_SORT_KEYS))
+    return results
+
+
+class Assets:
+    """Fingerprinted static file URLs.
+
+    Templates call static_url("css/app.css"), which takes the same arguments
+    as url_for("static", filename=...) and returns the URL of the build
+    listed in the manifest written by `flask assets build`, or the plain
+    static URL when the file wasn't built. The manifest is read once at
+    startup and ignored in debug mode, so edits show up while developing.
+
+    Builds never change, so the app serves them with a year-long immutable
+    Cache-Control (nginx should do the same for ASSETS_DIR).
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.manifest = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.directory = app.config.get("ASSETS_DIR", "dist")
+        self.manifest = {}
+        path = os.path.join(app.static_folder, self.directory, MANIFEST)
+        if not app.debug and os.path.exists(path):
+            with open(path, "rb") as f:
+                self.manifest = json.loads(f.read())
+
+        app.add_template_global(self.static_url)
+        app.after_request(self._after_request)
+
+    def static_url(self, filename, **values):
+        built = self.manifest.get(filename)
+        if built is not None:
+            filename = f"{self.directory}/{built}"
+        return url_for("static", filename=filename, **values)
+
+    def _after_request(self, response):
+        if request.endpoint == "static" and request.view_args["filename"].startswith(
+            f"{self.directory}/"
+        ):
+            # send_file marks static files no-cache unless told otherwise
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        return response
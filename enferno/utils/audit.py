@@ -0,0 +1,331 @@
+import atexit
+import glob
+import os
+import queue
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime
+
+import orjson as json
+from flask import has_app_context
+from sqlalchemy import insert
+from sqlalchemy.exc import DBAPIError, OperationalError, StatementError
+
+
+class AuditUnavailable(Exception):
+    """Audit rows couldn't be written for a reason other than their contents,
+    typically the database being unreachable. `rows` are the ones not written.
+    """
+
+    def __init__(self, rows, error):
+        super().__init__(_describe(error))
+        self.rows = rows
+
+
+def _rejected(error):
+    """Whether the database turned the rows down, rather than being unusable."""
+    if not isinstance(error, StatementError):
+        return False
+    if isinstance(error, DBAPIError):
+        return not (error.connection_invalidated or isinstance(error, OperationalError))
+    return True
+
+
+def _describe(error):
+    # The DBAPI error's first line only: SQLAlchemy's message repeats the
+    # parameters, and Postgres' DETAIL the failing row, either of which would
+    # copy audit payloads and emails into the log
+    if isinstance(error, str):
+        return error
+    orig = getattr(error, "orig", None)
+    lines = str(orig if orig is not None else error).strip().splitlines()
+    return lines[0] if lines else type(error).__name__
+
+
+class AuditWriter:
+    """Buffers audit rows in process and writes them with multi-row INSERTs.
+
+    Rows are written on their own connection, so queuing an event never commits
+    the caller's session. AUDIT_WRITE_MODE selects when:
+
+    - "request": flush when the app context tears down (end of every request,
+      CLI command or task). The default.
+    - "thread": a background thread flushes every AUDIT_FLUSH_INTERVAL seconds.
+    - "sync": write immediately, for tests and scripts.
+
+    The queue is bounded by AUDIT_QUEUE_SIZE; when it is full the caller flushes
+    inline rather than dropping events. Anything still queued is flushed at exit.
+
+    When the database rejects a batch because of a row in it, the rows are
+    retried one by one and those still rejected go to a dead-letter file in
+    AUDIT_SPOOL_DIR. When it is unavailable, the batch is kept and retried by
+    later flushes, up to AUDIT_MAX_RETRIES times, waiting AUDIT_RETRY_BACKOFF
+    seconds, doubled on every attempt. After that, or at exit, it is appended
+    to a spool file in AUDIT_SPOOL_DIR, which `flask activities replay` writes
+    back.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._queue = None
+        self._lock = threading.RLock()
+        self._wakeup = threading.Event()
+        # (due, attempt, rows) batches whose INSERT failed
+        self._retries = []
+        self._thread = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.mode = app.config.get("AUDIT_WRITE_MODE", "request")
+        self.batch_size = app.config.get("AUDIT_BATCH_SIZE", 500)
+        self.interval = app.config.get("AUDIT_FLUSH_INTERVAL", 2.0)
+        self.max_retries = app.config.get("AUDIT_MAX_RETRIES", 3)
+        self.retry_backoff = app.config.get("AUDIT_RETRY_BACKOFF", 1.0)
+        self.spool_dir = app.config.get("AUDIT_SPOOL_DIR") or os.path.join(
+            app.instance_path, "audit-spool"
+        )
+        self._queue = queue.Queue(maxsize=app.config.get("AUDIT_QUEUE_SIZE", 10000))
+
+        if self.mode == "request":
+            app.teardown_appcontext(lambda exc: self.flush())
+        atexit.register(self.shutdown)
+
+    @property
+    def pending(self):
+        if self._queue is None:
+            return 0
+        return self._queue.qsize() + sum(len(rows) for _, _, rows in self._retries)
+
+    def enqueue(self, row):
+        """Queue an Activity row (a dict of column values) for writing."""
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            # Back-pressure: drain on the caller's thread instead of losing events
+            self.flush()
+            if self._queue.full():
+                # Flushing is failing; spool a batch rather than block the caller
+                with self._lock:
+                    self._spool(self._drain(), 0, "audit queue full")
+            self._queue.put(row)
+
+        if self.mode == "sync":
+            self.flush()
+        elif self.mode == "thread":
+            self._ensure_thread()
+            if self.pending >= self.batch_size:
+                self._wakeup.set()
+
+    def flush(self):
+        """Write everything queued so far, and failed batches that are due for
+        a retry. Safe to call from any thread."""
+        # Popping a context we pushed runs teardown (and so flush) again; the
+        # lock is reentrant and the queue is empty by then, so that is a no-op
+        ctx = nullcontext() if has_app_context() else self.app.app_context()
+        with self._lock, ctx:
+            now = time.monotonic()
+            due = [entry for entry in self._retries if entry[0] <= now]
+            self._retries = [entry for entry in self._retries if entry[0] > now]
+            for index, (_, attempt, rows) in enumerate(due):
+                if not self._write(rows, attempt):
+                    # The database is still failing; try the rest later
+                    self._retries += due[index + 1 :]
+                    return
+            while rows := self._drain():
+                if not self._write(rows, 0):
+                    return
+
+    def shutdown(self):
+        self._wakeup.set()
+        if self.pending:
+            self.flush()
+        # Retries that didn't come due before exit would be lost with the process
+        with self._lock:
+            for _, attempt, rows in self._retries:
+                self._spool(rows, attempt, "shutting down")
+            self._retries = []
+
+    def replay(self):
+        """Write the rows spooled by failed flushes to the activity table.
+
+        Rows go in the same way as a flush (see _insert), so rows the database
+        rejects are dead-lettered instead of blocking the file. Each spool file
+        is removed once its rows are written. If the database is unavailable,
+        the unwritten rows are put back and AuditUnavailable is raised.
+        Returns the number of rows written.
+        """
+        total = 0
+        pattern = os.path.join(self.spool_dir, "audit-*.jsonl*")
+        for path in sorted(glob.glob(pattern)):
+            # Take the file over first, so a worker spooling now starts a new
+            # one; a file still marked from an interrupted replay is retried
+            claimed = path if path.endswith(".replaying") else f"{path}.replaying"
+            os.replace(path, claimed)
+            rows, unreadable = [], []
+            with open(claimed, "rb") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        row = json.loads(line)
+                        row["created_at"] = datetime.fromisoformat(row["created_at"])
+                    except (TypeError, KeyError, ValueError) as e:
+                        unreadable.append((line.decode(errors="replace"), e))
+                    else:
+                        rows.append(row)
+            if unreadable:
+                self._dead_letter(unreadable)
+
+            try:
+                total += self._insert(rows)
+            except AuditUnavailable as e:
+                # Keep only what wasn't written, so the next replay doesn't
+                # insert the rest twice
+                self._dump(claimed, e.rows, "wb")
+                raise
+            os.remove(claimed)
+        return total
+
+    def _write(self, rows, attempt):
+        """Insert one batch; if the database is unavailable keep what wasn't
+        written for a retry, or spool it."""
+        try:
+            self._insert(rows)
+        except AuditUnavailable as e:
+            rows = e.rows
+            if attempt < self.max_retries:
+                self._retries.append(
+                    (
+                        time.monotonic() + self.retry_backoff * 2**attempt,
+                        attempt + 1,
+                        rows,
+                    )
+                )
+                self.app.logger.error(
+                    f"Audit flush of {len(rows)} rows failed (attempt "
+                    f"{attempt + 1} of {self.max_retries + 1}), will retry: {e}"
+                )
+            else:
+                self._spool(rows, attempt, e)
+            return False
+        return True
+
+    def _insert(self, rows):
+        """Insert rows with multi-row INSERTs in one transaction.
+
+        If the database rejects the batch because of its contents (a NULL
+        user_id, a value it can't store), each row is retried in its own
+        transaction and the ones still rejected go to the dead-letter file, so
+        one bad row neither holds up nor takes down the rest. Failures that
+        aren't about the rows raise AuditUnavailable with the rows not yet
+        written. Returns the number of rows written.
+        """
+        from enferno.extensions import db
+        from enferno.user.models import Activity
+
+        try:
+            with db.engine.begin() as conn:
+                for start in range(0, len(rows), self.batch_size):
+                    batch = rows[start : start + self.batch_size]
+                    conn.execute(insert(Activity).values(batch))
+        except Exception as e:
+            if not _rejected(e):
+                raise AuditUnavailable(rows, e) from None
+        else:
+            self._written(len(rows))
+            return len(rows)
+
+        written, rejected = 0, []
+        for index, row in enumerate(rows):
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(insert(Activity).values(row))
+            except Exception as e:
+                if not _rejected(e):
+                    self._written(written)
+                    raise AuditUnavailable(rows[index:], e) from None
+                rejected.append((row, e))
+            else:
+                written += 1
+        self._written(written)
+        if rejected:
+            self._dead_letter(rejected)
+        return written
+
+    def _written(self, count):
+        from enferno.user.models import Activity
+        from enferno.utils.counters import adjust
+
+        # Core inserts bypass the ORM events that maintain the row count
+        adjust(Activity.__tablename__, count)
+
+    def _spool(self, rows, attempt, error):
+        path = os.path.join(self.spool_dir, f"audit-{os.getpid()}.jsonl")
+        try:
+            self._dump(path, rows)
+        except OSError as e:
+            self.app.logger.critical(
+                f"Audit flush of {len(rows)} rows failed and spooling them to "
+                f"{path} failed too, rows lost: {error}; {e}"
+            )
+            return
+        self.app.logger.error(
+            f"Audit flush of {len(rows)} rows failed after {attempt + 1} "
+            f"attempts, spooled to {path} ({error}); replay it with "
+            f"`flask activities replay`"
+        )
+
+    def _dead_letter(self, rejected):
+        """Set aside (row, error) pairs the database won't take, for a person
+        to look at; replay never picks these files up."""
+        path = os.path.join(self.spool_dir, f"dead-letter-{os.getpid()}.jsonl")
+        entries = [{"error": _describe(error), "row": row} for row, error in rejected]
+        try:
+            self._dump(path, entries)
+        except OSError as e:
+            self.app.logger.critical(
+                f"{len(rejected)} audit rows were rejected by the database and "
+                f"writing them to {path} failed, rows lost: {e}"
+            )
+            return
+        self.app.logger.error(
+            f"{len(rejected)} audit rows were rejected by the database and "
+            f"written to {path}: {_describe(rejected[0][1])}"
+        )
+
+    def _dump(self, path, entries, mode="ab"):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        with open(path, mode) as f:
+            for entry in entries:
+                f.write(json.dumps(entry, default=str, option=json.OPT_APPEND_NEWLINE))
+
+    def _drain(self):
+        rows = []
+        while len(rows) < self.batch_size:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _ensure_thread(self):
+        # Threads don't survive fork, so each (uwsgi) worker starts its own lazily
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._run, name="audit-writer", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
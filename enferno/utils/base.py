@@ -1,9 +1,19 @@
 from flask import current_app
 from sqlalchemy import exc
+from sqlalchemy.orm import make_transient_to_detached
 
 from enferno.extensions import db
 
 
+def detached(model, columns):
+    """A detached `model` instance with `columns` as its loaded state, for
+    rebuilding cached rows. db.session.merge(obj, load=False) then adopts it
+    without a query; columns left out are expired and load when read."""
+    obj = model(**columns)
+    make_transient_to_detached(obj)
+    return obj
+
+
 class BaseMixin:
     def save(self, commit=True):
         db.session.add(self)
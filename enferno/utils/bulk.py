@@ -0,0 +1,356 @@
+import datetime
+
+from flask import current_app
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError, StatementError
+from sqlalchemy.orm import selectinload
+
+from enferno.extensions import db, hasher, role_registry
+from enferno.user.models import (
+    Activity,
+    OAuth,
+    Role,
+    Session,
+    User,
+    WebAuthn,
+    roles_users,
+)
+from enferno.utils.counters import adjust
+
+MAX_OPERATIONS = 1000
+OPERATIONS = ("create", "update", "delete")
+
+# The columns each model's from_dict writes (password and roles are separate)
+WRITABLE = {
+    "user": ("name", "username", "email", "active"),
+    "role": ("name", "description"),
+}
+TYPE_NAMES = {str: "a string", bool: "true or false", int: "an integer"}
+
+
+class BulkError(Exception):
+    """A single operation is invalid; reported for that item only."""
+
+
+def parse_operations(payload):
+    """Return the operations list of a bulk request, or raise ValueError."""
+    operations = payload.get("operations") if isinstance(payload, dict) else None
+    if not isinstance(operations, list) or not operations:
+        raise ValueError("operations must be a non-empty list")
+
+    limit = current_app.config.get("BULK_MAX_OPERATIONS", MAX_OPERATIONS)
+    if len(operations) > limit:
+        raise ValueError(f"At most {limit} operations per request")
+    if not all(isinstance(op, dict) for op in operations):
+        raise ValueError("Each operation must be an object")
+    return operations
+
+
+def bulk_users(operations, actor_id):
+    """Apply user create, update and delete operations in one transaction.
+
+    Operations look like {"op": "create", "item": {...}},
+    {"op": "update", "id": 1, "item": {...}} or {"op": "delete", "id": 1},
+    with items in the same shape as the single-user endpoints. All referenced
+    users, roles and existing emails are loaded with one query each, new
+    passwords are hashed in parallel, and deletes are set-based DELETEs.
+
+    Returns one result per operation: {"index", "ok", "id"} or
+    {"index", "ok": False, "error"}.
+    """
+    checked = _well_formed(operations, User)
+    ids = _ids(checked)
+    users = {
+        user.id: user
+        for user in db.session.scalars(
+            select(User).where(User.id.in_(ids)).options(selectinload(User.roles))
+        )
+    }
+    role_ids = {
+        role.get("id") for op in checked for role in _item(op).get("roles") or []
+    }
+    roles = {role.id: role for role in role_registry.instances(role_ids)}
+    emails = {_item(op).get("email") for op in checked} - {None}
+    taken = set(db.session.scalars(select(User.email).where(User.email.in_(emails))))
+
+    passwords = {
+        index: _item(op)["password"]
+        for index, op in enumerate(operations)
+        if op.get("op") in ("create", "update")
+        and _item(op).get("password")
+        and _type_error(op, User) is None
+    }
+    hashed = dict(
+        zip(passwords, hasher.hash_many(list(passwords.values())), strict=True)
+    )
+
+    def step(index, op):
+        kind, item = op.get("op"), _item(op)
+        if kind == "create":
+            email = item.get("email")
+            if not email:
+                raise BulkError("Email is required")
+            if email in taken:
+                raise BulkError("Email already exists")
+            if index not in hashed:
+                raise BulkError("Password is required")
+            taken.add(email)
+            return lambda: _create_user(item, hashed[index], roles)
+
+        user = users.get(op.get("id"))
+        if user is None:
+            raise BulkError("User not found")
+        if kind == "delete":
+            return user
+        email = item.get("email")
+        if email and email != user.email:
+            if email in taken:
+                raise BulkError("Email already exists")
+            taken.add(email)
+        return lambda: _update_user(user, item, hashed.get(index), roles)
+
+    return _run(operations, step, actor_id, User, _delete_users, "User")
+
+
+def bulk_roles(operations, actor_id):
+    """Apply role create, update and delete operations in one transaction.
+
+    Same request and result shape as bulk_users. Deleting a role removes it
+    from all users with one DELETE on the association table.
+    """
+    checked = _well_formed(operations, Role)
+    ids = _ids(checked)
+    roles = {
+        role.id: role
+        for role in db.session.scalars(select(Role).where(Role.id.in_(ids)))
+    }
+    names = {_item(op).get("name") for op in checked} - {None}
+    taken = {name for name in names if role_registry.get(name) is not None}
+
+    def step(index, op):
+        kind, item = op.get("op"), _item(op)
+        if kind == "create":
+            name = item.get("name")
+            if not name:
+                raise BulkError("Name is required")
+            if name in taken:
+                raise BulkError("Role already exists")
+            taken.add(name)
+            return lambda: _create_role(item)
+
+        role = roles.get(op.get("id"))
+        if role is None:
+            raise BulkError("Role not found")
+        if kind == "delete":
+            return role
+        name = item.get("name")
+        if name and name != role.name:
+            if name in taken:
+                raise BulkError("Role already exists")
+            taken.add(name)
+        return lambda: _update_role(role, item)
+
+    return _run(operations, step, actor_id, Role, _delete_roles, "Role")
+
+
+def _run(operations, step, actor_id, model, delete_rows, label):
+    results = [None] * len(operations)
+    changes, deletes = [], []
+    seen_ids = set()
+    for index, op in enumerate(operations):
+        try:
+            if op.get("op") not in OPERATIONS:
+                raise BulkError("op must be create, update or delete")
+            error = _type_error(op, model)
+            if error:
+                raise BulkError(error)
+            if op.get("id") is not None:
+                if op["id"] in seen_ids:
+                    raise BulkError("Duplicate id in this request")
+                seen_ids.add(op["id"])
+            target = step(index, op)
+        except BulkError as e:
+            results[index] = {"index": index, "ok": False, "error": str(e)}
+            continue
+        if callable(target):
+            changes.append((index, target))
+        else:
+            deletes.append((index, target))
+
+    # Snapshot deleted rows for the audit log before they go
+    deleted = [
+        (index, f"{label} Delete", obj.to_dict(), obj.id) for index, obj in deletes
+    ]
+
+    try:
+        audits = [(index, apply()) for index, apply in changes]
+        db.session.flush()
+        entries = [(index, *audit()) for index, audit in audits]
+        if deletes:
+            delete_rows([obj.id for _, obj in deletes])
+        db.session.commit()
+        entries += deleted
+    except StatementError:
+        # Something raced the up-front checks or the database refused a value;
+        # retry item by item so only the failing operations fail
+        db.session.rollback()
+        entries = []
+        for index, apply in changes:
+            try:
+                with db.session.begin_nested():
+                    audit = apply()
+                    db.session.flush()
+                    entries.append((index, *audit()))
+            except StatementError as e:
+                results[index] = _failed(index, e)
+        for entry, (index, obj) in zip(deleted, deletes, strict=True):
+            try:
+                with db.session.begin_nested():
+                    delete_rows([obj.id])
+                entries.append(entry)
+            except StatementError as e:
+                results[index] = _failed(index, e)
+        db.session.commit()
+
+    removed = sum(1 for _, action, _, _ in entries if action.endswith("Delete"))
+    if removed:
+        # Core deletes bypass the ORM events that maintain counts
+        adjust(model.__tablename__, -removed)
+
+    # Queued together, so the audit writer inserts them as one batch
+    for index, action, data, record_id in entries:
+        results[index] = {"index": index, "ok": True, "id": record_id}
+        Activity.register(actor_id, action, data)
+    return results
+
+
+def _failed(index, error):
+    message = (
+        "Conflicts with existing data"
+        if isinstance(error, IntegrityError)
+        else "Rejected by the database"
+    )
+    return {"index": index, "ok": False, "error": message}
+
+
+def _ids(operations):
+    return {op.get("id") for op in operations if op.get("op") in ("update", "delete")}
+
+
+def _well_formed(operations, model):
+    return [op for op in operations if _type_error(op, model) is None]
+
+
+def _type_error(op, model):
+    """Return why an operation carries a value the database won't take, or None.
+
+    Ids and emails end up in sets and IN clauses, and every written value in a
+    flush shared by the whole batch, so a value of the wrong type or length
+    has to be rejected for that operation before it gets there. Columns are
+    checked against their type, nullability and length.
+    """
+    if op.get("id") is not None and not _is_int(op["id"]):
+        return "id must be an integer"
+    item = _item(op)
+    columns = model.__table__.columns
+    for field in WRITABLE[model.__tablename__]:
+        if field in item:
+            error = _column_error(columns[field], item[field])
+            if error:
+                return f"{field} {error}"
+    if item.get("password") is not None and not isinstance(item["password"], str):
+        return "password must be a string"
+    roles = item.get("roles")
+    if roles is not None and not (
+        isinstance(roles, list)
+        and all(isinstance(r, dict) and _is_int(r.get("id")) for r in roles)
+    ):
+        return "roles must be a list of objects with an integer id"
+    return None
+
+
+def _column_error(column, value):
+    if value is None:
+        return None if column.nullable else "is required"
+    expected = column.type.python_type
+    valid = _is_int(value) if expected is int else isinstance(value, expected)
+    if not valid:
+        return f"must be {TYPE_NAMES.get(expected, expected.__name__)}"
+    length = getattr(column.type, "length", None)
+    if length and len(value) > length:
+        return f"must be at most {length} characters"
+    return None
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _item(op):
+    item = op.get("item")
+    return item if isinstance(item, dict) else {}
+
+
+def _assign_roles(user, item, roles):
+    # Same rule as User.from_dict: an empty list leaves roles unchanged
+    role_ids = [r.get("id") for r in item.get("roles") or [] if isinstance(r, dict)]
+    if role_ids:
+        user.roles = [roles[i] for i in role_ids if i in roles]
+
+
+def _fields(item, *excluded):
+    return {k: v for k, v in item.items() if k not in ("password", "roles", *excluded)}
+
+
+def _create_user(item, password, roles):
+    # roles starts loaded, so to_dict below doesn't lazy load it per user
+    user = User(roles=[], confirmed_at=datetime.datetime.now())
+    user.from_dict(_fields(item))
+    user.password = password
+    _assign_roles(user, item, roles)
+    db.session.add(user)
+    return lambda: ("User Create", user.to_dict(), user.id)
+
+
+def _update_user(user, item, password, roles):
+    old = user.to_dict()
+    user.from_dict(_fields(item))
+    if password:
+        user.password = password
+    _assign_roles(user, item, roles)
+    return lambda: ("User Update", {"old": old, "new": user.to_dict()}, user.id)
+
+
+def _delete_users(ids):
+    handles = select(User.fs_webauthn_user_handle).where(User.id.in_(ids))
+    db.session.execute(delete(roles_users).where(roles_users.c.user_id.in_(ids)))
+    db.session.execute(delete(WebAuthn).where(WebAuthn.user_id.in_(handles)))
+    db.session.execute(delete(OAuth).where(OAuth.user_id.in_(ids)))
+    db.session.execute(delete(Session).where(Session.user_id.in_(ids)))
+    db.session.execute(
+        delete(User)
+        .where(User.id.in_(ids))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _create_role(item):
+    role = Role()
+    role.from_dict(item)
+    db.session.add(role)
+    return lambda: ("Role Create", role.to_dict(), role.id)
+
+
+def _update_role(role, item):
+    old = role.to_dict()
+    role.from_dict(item)
+    return lambda: ("Role Update", {"old": old, "new": role.to_dict()}, role.id)
+
+
+def _delete_roles(ids):
+    db.session.execute(delete(roles_users).where(roles_users.c.role_id.in_(ids)))
+    db.session.execute(
+        delete(Role)
+        .where(Role.id.in_(ids))
+        .execution_options(synchronize_session=False)
+    )
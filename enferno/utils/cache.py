@@ -0,0 +1,409 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from uuid import uuid4
+
+import orjson as json
+from flask_caching.backends.base import BaseCache
+
+MISSING = object()
+
+# Invalidations older than this are pruned; it must exceed CACHE_LOCAL_TTL
+INVALIDATION_RETENTION = 3600
+
+
+def _origin(channel):
+    # Tells a process its own messages apart. Forked workers share the
+    # channel object, so the pid is part of it
+    return f"{channel.instance}-{os.getpid()}"
+
+
+class LocalCache:
+    """A bounded, thread-safe LRU mapping with a time to live per entry.
+
+    Values are stored as-is when immutable and pickled otherwise, so callers
+    can't change a cached object by mutating what get() returned.
+    """
+
+    def __init__(self, size=1024, ttl=30):
+        self.size = size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires, pickled = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+        return pickle.loads(value) if pickled else value
+
+    def set(self, key, value, ttl=None):
+        pickled = not isinstance(value, int | float | str | bytes | type(None))
+        entry = (
+            pickle.dumps(value) if pickled else value,
+            time.monotonic() + min(ttl or self.ttl, self.ttl),
+            pickled,
+        )
+        with self._lock:
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def evict(self, keys=None):
+        """Drop `keys`, or everything when keys is None."""
+        with self._lock:
+            if keys is None:
+                self._data.clear()
+            for key in keys or ():
+                self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache(BaseCache):
+    """A cache in a SQLite file, shared by the worker processes on one host.
+
+    The stand-in for Redis when it isn't configured. Integers are stored as
+    such so inc() is a single atomic UPDATE; everything else is pickled. The
+    file also holds the invalidation log that SQLiteChannel polls.
+    """
+
+    def __init__(self, path, default_timeout=300):
+        super().__init__(default_timeout)
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY, value BLOB, expires REAL
+            );
+            CREATE TABLE IF NOT EXISTS invalidations (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                origin TEXT, key TEXT, at REAL
+            );
+            """
+        )
+
+    def _db(self):
+        # One connection per thread, and new ones after a fork
+        if getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return self._local.conn
+
+    def _expires(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return time.time() + timeout if timeout > 0 else None
+
+    def get(self, key):
+        row = (
+            self._db()
+            .execute("SELECT value, expires FROM cache WHERE key = ?", (key,))
+            .fetchone()
+        )
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return pickle.loads(row[0]) if isinstance(row[0], bytes) else row[0]
+
+    def set(self, key, value, timeout=None):
+        stored = value if type(value) is int else pickle.dumps(value)
+        self._db().execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (key, stored, self._expires(timeout)),
+        )
+        self._purge()
+        return True
+
+    def add(self, key, value, timeout=None):
+        stored = value if type(value) is int else pickle.dumps(value)
+        cursor = self._db().execute(
+            "INSERT INTO cache (key, value, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value, "
+            "expires = excluded.expires "
+            "WHERE cache.expires IS NOT NULL AND cache.expires < ?",
+            (key, stored, self._expires(timeout), time.time()),
+        )
+        return cursor.rowcount > 0
+
+    def inc(self, key, delta=1):
+        # An expired counter starts over, and like a new one never expires
+        now = time.time()
+        row = (
+            self._db()
+            .execute(
+                "INSERT INTO cache (key, value, expires) VALUES (?, ?, NULL) "
+                "ON CONFLICT (key) DO UPDATE SET value = CASE "
+                "WHEN cache.expires < ? THEN excluded.value "
+                "ELSE cache.value + excluded.value END, "
+                "expires = CASE WHEN cache.expires < ? THEN NULL "
+                "ELSE cache.expires END RETURNING value",
+                (key, delta, now, now),
+            )
+            .fetchone()
+        )
+        return row[0]
+
+    def dec(self, key, delta=1):
+        return self.inc(key, -delta)
+
+    def delete(self, key):
+        return (
+            self._db().execute("DELETE FROM cache WHERE key = ?", (key,)).rowcount > 0
+        )
+
+    def has(self, key):
+        return self.get(key) is not None
+
+    def clear(self):
+        self._db().execute("DELETE FROM cache")
+        return True
+
+    def _purge(self):
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            now = time.time()
+            db = self._db()
+            db.execute("DELETE FROM cache WHERE expires < ?", (now,))
+            db.execute(
+                "DELETE FROM invalidations WHERE at < ?",
+                (now - INVALIDATION_RETENTION,),
+            )
+
+
+class SQLiteChannel:
+    """Cache invalidations through a log table in the SQLite stand-in.
+
+    Each process reads the entries added since its last poll, at most every
+    `interval` seconds, so a write is seen by the other workers within that.
+    """
+
+    def __init__(self, cache, interval=0.5):
+        self.cache = cache
+        self.interval = interval
+        self.instance = uuid4().hex
+        self._lock = threading.Lock()
+        self._polled = 0.0
+        self._seq = (
+            cache._db()
+            .execute("SELECT coalesce(max(seq), 0) FROM invalidations")
+            .fetchone()[0]
+        )
+
+    def subscribe(self, evict):
+        self.evict = evict
+
+    def publish(self, keys):
+        """Record that `keys` changed (None: everything was cleared)."""
+        now = time.time()
+        origin = _origin(self)
+        self.cache._db().executemany(
+            "INSERT INTO invalidations (origin, key, at) VALUES (?, ?, ?)",
+            [(origin, key, now) for key in ([None] if keys is None else keys)],
+        )
+
+    def poll(self):
+        if time.monotonic() - self._polled < self.interval:
+            return
+        # Another thread of this process is already reading the log
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._polled = time.monotonic()
+            rows = (
+                self.cache._db()
+                .execute(
+                    "SELECT seq, origin, key FROM invalidations WHERE seq > ? "
+                    "ORDER BY seq",
+                    (self._seq,),
+                )
+                .fetchall()
+            )
+            if not rows:
+                return
+            self._seq = rows[-1][0]
+            me = _origin(self)
+            keys = [key for _, origin, key in rows if origin != me]
+            if None in keys:
+                self.evict(None)
+            elif keys:
+                self.evict(keys)
+        finally:
+            self._lock.release()
+
+
+class RedisChannel:
+    """Cache invalidations over Redis pub/sub.
+
+    A listener thread per process evicts as messages arrive. Whenever it
+    (re)subscribes, the whole local tier is dropped, since messages sent
+    while it wasn't listening are lost.
+    """
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.instance = uuid4().hex
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, evict):
+        self.evict = evict
+
+    def publish(self, keys):
+        self.client.publish(self.name, json.dumps([_origin(self), keys]))
+
+    def poll(self):
+        # Threads don't survive fork, so each (uwsgi) worker starts its own lazily
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._listen, name="cache-invalidation", daemon=True
+                )
+                self._thread.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.name)
+                self.evict(None)
+                me = _origin(self)
+                for message in pubsub.listen():
+                    origin, keys = json.loads(message["data"])
+                    if origin != me:
+                        self.evict(keys)
+            except Exception:
+                time.sleep(1)
+
+
+class TieredCache(BaseCache):
+    """A per-process LRU in front of a cache shared by all workers.
+
+    Reads are served from the local tier when possible and fall back to the
+    shared one (the SQLite stand-in, or Redis when CACHE_REDIS_URL is set);
+    writes go to the shared tier
+    and are broadcast on an invalidation channel so every other process
+    evicts its local copy. Local entries live at most CACHE_LOCAL_TTL
+    seconds, which bounds staleness if an invalidation is ever missed.
+    add() and inc() run on the shared tier, so they stay atomic across
+    workers.
+
+    Hits and misses are exported per tier as cache_requests_total.
+    """
+
+    def __init__(
+        self, shared, channel, size=1024, ttl=30, default_timeout=300, metrics=None
+    ):
+        super().__init__(default_timeout)
+        self.shared = shared
+        self.channel = channel
+        self.metrics = metrics
+        self.local = LocalCache(size, ttl)
+        channel.subscribe(self.local.evict)
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        from enferno.extensions import metrics
+
+        default_timeout = kwargs.get("default_timeout", 300)
+        url = config.get("CACHE_REDIS_URL")
+        if url:
+            import redis
+            from flask_caching.backends.rediscache import RedisCache
+
+            client = redis.from_url(url)
+            prefix = config.get("CACHE_KEY_PREFIX") or ""
+            shared = RedisCache(
+                host=client, key_prefix=prefix, default_timeout=default_timeout
+            )
+            channel = RedisChannel(client, f"{prefix}cache-invalidation")
+        else:
+            shared = SQLiteCache(config["CACHE_SQLITE_PATH"], default_timeout)
+            channel = SQLiteChannel(
+                shared, config.get("CACHE_INVALIDATION_INTERVAL", 0.5)
+            )
+
+        return cls(
+            shared,
+            channel,
+            size=config.get("CACHE_LOCAL_SIZE", 1024),
+            ttl=config.get("CACHE_LOCAL_TTL", 30),
+            default_timeout=default_timeout,
+            metrics=metrics,
+        )
+
+    def get(self, key):
+        self.channel.poll()
+        value = self.local.get(key, MISSING)
+        if value is not MISSING:
+            self._count("local", "hit")
+            return value
+        self._count("local", "miss")
+
+        value = self.shared.get(key)
+        self._count("shared", "miss" if value is None else "hit")
+        if value is not None:
+            self.local.set(key, value)
+        return value
+
+    def set(self, key, value, timeout=None):
+        result = self.shared.set(key, value, timeout)
+        self._changed(key, value, timeout)
+        return result
+
+    def add(self, key, value, timeout=None):
+        added = self.shared.add(key, value, timeout)
+        if added:
+            self._changed(key, value, timeout)
+        return added
+
+    def inc(self, key, delta=1):
+        value = self.shared.inc(key, delta)
+        self._changed(key, value)
+        return value
+
+    def dec(self, key, delta=1):
+        return self.inc(key, -delta)
+
+    def delete(self, key):
+        self.local.evict([key])
+        deleted = self.shared.delete(key)
+        self.channel.publish([key])
+        return deleted
+
+    def has(self, key):
+        return self.shared.has(key)
+
+    def clear(self):
+        self.local.evict(None)
+        self.shared.clear()
+        self.channel.publish(None)
+        return True
+
+    def _changed(self, key, value, timeout=None):
+        timeout = self._normalize_timeout(timeout)
+        self.local.set(key, value, ttl=timeout or None)
+        self.channel.publish([key])
+
+    def _count(self, tier, result):
+        if self.metrics is not None:
+            self.metrics.inc("cache_requests_total", {"tier": tier, "result": result})
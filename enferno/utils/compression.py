@@ -0,0 +1,92 @@
+import gzip
+import importlib.util
+
+from flask import request
+
+# Brotli is optional; without it everything is gzip only
+BROTLI_AVAILABLE = importlib.util.find_spec("brotli") is not None
+
+# Preferred first when the client accepts several
+ENCODINGS = ("br", "gzip") if BROTLI_AVAILABLE else ("gzip",)
+
+# No text/html: pages carry a per-session CSRF token next to reflected input
+# (login and register forms echo `next` and the query string), which is what
+# BREACH needs to recover the token from compressed response sizes
+COMPRESSIBLE_MIMETYPES = (
+    "text/css",
+    "text/plain",
+    "text/csv",
+    "text/xml",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "image/svg+xml",
+)
+
+
+def compress(data, encoding, best=False):
+    """Compress bytes as `encoding` ("br" or "gzip").
+
+    The default levels are quick enough to run per response; `best` trades
+    time for size, for files compressed once at build time.
+    """
+    if encoding == "br":
+        import brotli
+
+        return brotli.compress(data, quality=11 if best else 4)
+    return gzip.compress(data, compresslevel=9 if best else 6, mtime=0)
+
+
+class Compression:
+    """Compresses dynamic responses on the fly.
+
+    Responses of a COMPRESS_MIMETYPES type and at least COMPRESS_MIN_SIZE
+    bytes are sent as brotli or gzip, whichever the client prefers. Streamed
+    responses and files (direct passthrough) are left alone; static files
+    are precompressed by `flask assets build` instead.
+
+    Compressing changes the bytes, so a strong ETag is downgraded to a weak
+    one, as nginx does; If-None-Match still matches it.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.min_size = app.config.get("COMPRESS_MIN_SIZE", 1024)
+        self.mimetypes = set(
+            app.config.get("COMPRESS_MIMETYPES", COMPRESSIBLE_MIMETYPES)
+        )
+        if app.config.get("COMPRESS_ENABLED", True):
+            app.after_request(self._after_request)
+
+    def _after_request(self, response):
+        if (
+            response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in self.mimetypes
+        ):
+            return response
+
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+
+        # The body depends on the request's Accept-Encoding from here on
+        response.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(ENCODINGS)
+        if encoding is None:
+            return response
+
+        response.set_data(compress(data, encoding))
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
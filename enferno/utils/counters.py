@@ -0,0 +1,100 @@
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session, object_session
+
+from enferno.extensions import cache, db
+from enferno.user.models import Activity, Role, User
+from enferno.utils.pagination import ESTIMATE_THRESHOLD, estimate_rows
+
+RECONCILE_INTERVAL = 900
+
+MODELS = {model.__tablename__: model for model in (User, Role, Activity)}
+
+
+def get_count(table):
+    """Return the row count for a tracked table without scanning it.
+
+    Counts live in the `cache` extension and are adjusted on every committed
+    insert/delete. A cold cache is seeded from the planner estimate for large
+    tables (exact COUNT(*) otherwise), and once a count is older than
+    COUNTER_RECONCILE_INTERVAL it is re-counted in a background thread to
+    correct any drift while the current value is still served.
+    """
+    value = cache.get(f"counter:{table}")
+    if value is None:
+        value = _seed(table)
+
+    reconciled_at = cache.get(f"counter:{table}:at") or 0
+    interval = current_app.config.get("COUNTER_RECONCILE_INTERVAL", RECONCILE_INTERVAL)
+    # cache.add is a cross-worker "only one of us" lock on shared backends
+    if time.time() - reconciled_at > interval and cache.add(
+        f"counter:{table}:lock", 1, timeout=interval
+    ):
+        app = current_app._get_current_object()
+        threading.Thread(
+            target=_reconcile_in_background, args=(app, table), daemon=True
+        ).start()
+    return value
+
+
+def adjust(table, delta):
+    """Apply a committed change of `delta` rows to a table's counter."""
+    key = f"counter:{table}"
+    # Only adjust a seeded counter; an unseeded one is counted on first read
+    if delta and cache.get(key) is not None:
+        cache.cache.inc(key, delta)
+
+
+def reconcile(table):
+    """Recount a table exactly and store the result."""
+    model = MODELS[table]
+    value = db.session.execute(db.select(func.count()).select_from(model)).scalar()
+    cache.set(f"counter:{table}", value, timeout=0)
+    cache.set(f"counter:{table}:at", time.time(), timeout=0)
+    return value
+
+
+def _seed(table):
+    estimate = estimate_rows(table)
+    threshold = current_app.config.get(
+        "PAGINATION_ESTIMATE_THRESHOLD", ESTIMATE_THRESHOLD
+    )
+    if estimate is not None and estimate >= threshold:
+        # Leave `at` unset so the exact count follows in the background
+        cache.set(f"counter:{table}", estimate, timeout=0)
+        return estimate
+    return reconcile(table)
+
+
+def _reconcile_in_background(app, table):
+    with app.app_context():
+        try:
+            reconcile(table)
+        finally:
+            db.session.remove()
+
+
+def _track(mapper, connection, target, delta):
+    session = object_session(target)
+    if session is not None:
+        deltas = session.info.setdefault("counter_deltas", {})
+        deltas[target.__tablename__] = deltas.get(target.__tablename__, 0) + delta
+
+
+for _model in MODELS.values():
+    event.listen(_model, "after_insert", lambda m, c, t: _track(m, c, t, 1))
+    event.listen(_model, "after_delete", lambda m, c, t: _track(m, c, t, -1))
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_deltas(session):
+    for table, delta in session.info.pop("counter_deltas", {}).items():
+        adjust(table, delta)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_deltas(session):
+    session.info.pop("counter_deltas", None)
@@ -0,0 +1,107 @@
+import csv
+import io
+from datetime import datetime
+
+import orjson as json
+from sqlalchemy.orm import selectinload
+
+from enferno.extensions import db
+from enferno.user.models import Activity, User
+
+BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+
+ACTIVITY_FIELDS = ["id", "user_id", "user_email", "action", "data", "created_at"]
+USER_FIELDS = ["id", "email", "name", "username", "active", "roles", "created_at"]
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def activity_rows(filters=(), batch_size=BATCH_SIZE):
+    """Yield activities newest first as plain dicts, `batch_size` rows at a time.
+
+    Selects columns rather than ORM objects and uses yield_per, which streams
+    from a server-side cursor on Postgres, so memory stays flat for any size.
+    """
+    query = (
+        db.select(
+            Activity.id,
+            Activity.user_id,
+            User.email.label("user_email"),
+            Activity.action,
+            Activity.data,
+            Activity.created_at,
+        )
+        .outerjoin(User, Activity.user_id == User.id)
+        .where(*filters)
+        .order_by(Activity.created_at.desc(), Activity.id.desc())
+        .execution_options(yield_per=batch_size)
+    )
+    for row in db.session.execute(query).mappings():
+        yield dict(row)
+
+
+def user_rows(batch_size=BATCH_SIZE):
+    """Yield users as plain dicts, with roles loaded once per batch."""
+    query = (
+        db.select(User)
+        .options(selectinload(User.roles))
+        .order_by(User.id)
+        .execution_options(yield_per=batch_size)
+    )
+    for user in db.session.scalars(query):
+        yield {
+            "id": user.id,
+            "email": user.email,
+            "name": user.name,
+            "username": user.username,
+            "active": user.active,
+            "roles": [role.name for role in user.roles],
+            "created_at": user.created_at,
+        }
+
+
+def ndjson_stream(rows):
+    """Encode dict rows as newline-delimited JSON, in CHUNK_SIZE byte chunks."""
+    chunk = bytearray()
+    for row in rows:
+        chunk += json.dumps(row, option=json.OPT_APPEND_NEWLINE)
+        if len(chunk) >= CHUNK_SIZE:
+            yield bytes(chunk)
+            chunk.clear()
+    if chunk:
+        yield bytes(chunk)
+
+
+def csv_stream(rows, fields):
+    """Encode dict rows as CSV with a header, in CHUNK_SIZE byte chunks."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore")
+    writer.writeheader()
+    for row in rows:
+        writer.writerow({key: _csv_value(value) for key, value in row.items()})
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def stream(rows, fields, fmt):
+    """Encode rows in `fmt` ("ndjson" or "csv")."""
+    if fmt == "csv":
+        return csv_stream(rows, fields)
+    return ndjson_stream(rows)
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, list) and all(isinstance(v, str) for v in value):
+        return ";".join(value)
+    if isinstance(value, dict | list):
+        return json.dumps(value).decode()
+    return value
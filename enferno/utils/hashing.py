@@ -0,0 +1,309 @@
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app
+from flask_security.utils import hash_password
+from passlib.context import CryptContext
+from passlib.registry import get_crypt_handler
+from werkzeug.exceptions import ServiceUnavailable
+
+QUEUE_TIMEOUT = 5.0
+
+# The pool worker's copy of the password context
+_context = None
+
+
+def _init_worker(config):
+    global _context
+    _context = CryptContext.from_string(config)
+
+
+def _ready():
+    return _context is not None
+
+
+def _run(method, args, kwargs):
+    started = time.time()
+    return started, getattr(_context, method)(*args, **kwargs)
+
+
+class HashingBusy(ServiceUnavailable):
+    description = "Too many sign-ins are being processed. Please try again shortly."
+
+
+class PooledCryptContext:
+    """Stands in for Flask-Security's CryptContext, sending the slow calls
+    (hash and verify) to the hashing pool. Cheap calls such as identify and
+    needs_update stay in process.
+    """
+
+    def __init__(self, context, hasher):
+        self._context = context
+        self._hasher = hasher
+
+    def hash(self, secret, **kwargs):
+        return self._hasher.submit("hash", secret, **kwargs)
+
+    def verify(self, secret, hash, **kwargs):
+        return self._hasher.submit("verify", secret, hash, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._context, name)
+
+
+class PasswordHasher:
+    """Runs password hashing and verification in a process pool.
+
+    Key stretching is CPU bound and holds the GIL, so hashing inline in a
+    uwsgi request thread stalls every other thread of that worker. Once
+    initialised (after Flask-Security), Flask-Security's password context is
+    replaced so `hash_password`, `verify_password`, login, registration and
+    the CLI commands all hash in HASH_POOL_SIZE worker processes instead.
+
+    At most HASH_MAX_PENDING calls per worker are queued or running; callers
+    beyond that wait up to HASH_QUEUE_TIMEOUT seconds for a slot and then get
+    a 503 with Retry-After, so a login flood sheds load instead of stalling
+    the site. Time spent queued is exported as a metric.
+
+    Each process starts its pool on its first call, which takes around a
+    second; calls hash inline until the pool is up, and for good if it can't
+    start (see _executor).
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pool = None
+        self._starting = None
+        self._warmup = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Call after Flask-Security has been initialised."""
+        from enferno.extensions import metrics
+
+        self.app = app
+        self.size = app.config.get("HASH_POOL_SIZE") or default_pool_size()
+        if not app.config.get("HASH_POOL_ENABLED", True):
+            return
+
+        self.max_pending = app.config.get("HASH_MAX_PENDING") or self.size * 4
+        self.timeout = app.config.get("HASH_QUEUE_TIMEOUT", QUEUE_TIMEOUT)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+        security = app.extensions["security"]
+        self._context = security.pwd_context
+        self._config = security.pwd_context.to_string()
+        security.pwd_context = PooledCryptContext(security.pwd_context, self)
+
+        metrics.register(
+            "password_hash_queue_wait_seconds",
+            "histogram",
+            "Time password hashing calls wait for a pool worker",
+        )
+        metrics.register(
+            "password_hash_rejected_total",
+            "counter",
+            "Password hashing calls refused because the pool was saturated",
+        )
+        atexit.register(self.shutdown)
+
+    def submit(self, method, *args, **kwargs):
+        """Call `method` of the password context in the pool (or inline, see
+        _executor) and wait for it."""
+        from enferno.extensions import metrics
+
+        requested = time.time()
+        if not self._slots.acquire(timeout=self.timeout):
+            metrics.inc("password_hash_rejected_total", {"op": method})
+            raise HashingBusy(retry_after=int(self.timeout) or 1)
+        try:
+            pool = self._executor()
+            if pool is None:
+                started = time.time()
+                result = getattr(self._context, method)(*args, **kwargs)
+            else:
+                started, result = pool.submit(_run, method, args, kwargs).result()
+        except BrokenProcessPool:
+            # A pool worker died (e.g. OOM killed); start a fresh pool next time
+            self._pid = None
+            raise
+        finally:
+            self._slots.release()
+
+        metrics.observe(
+            "password_hash_queue_wait_seconds",
+            {"op": method},
+            max(started - requested, 0.0),
+        )
+        return result
+
+    def hash_many(self, passwords):
+        """hash_password() a batch of passwords concurrently.
+
+        One thread per pool worker keeps the whole pool busy, so a batch hashes
+        roughly HASH_POOL_SIZE times faster than a loop over hash_password.
+        """
+        app = current_app._get_current_object()
+
+        def hash_one(password):
+            with app.app_context():
+                return hash_password(password)
+
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            return list(executor.map(hash_one, passwords))
+
+    def shutdown(self):
+        pool = self._pool or self._starting
+        if pool is not None and self._pid == os.getpid():
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _executor(self):
+        """This process's pool, or None while it starts or if it couldn't.
+
+        A pool's processes belong to the process that started it, so each
+        (uwsgi) worker starts its own on first use. That happens in a request
+        thread while the audit, mail and cache threads are running, so the
+        pool must not fork this process and inherit their held locks; its
+        processes start fresh and re-import the `__main__` script instead. A
+        script that runs code on import without an `if __name__ ==
+        "__main__":` guard makes them fail, in which case this process keeps
+        hashing inline.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._start()
+            elif self._warmup is not None and self._warmup.done():
+                error = self._warmup.exception()
+                if error is None:
+                    self._pool = self._starting
+                else:
+                    self._starting.shutdown(wait=False, cancel_futures=True)
+                    self._unavailable(error)
+                self._starting = self._warmup = None
+            return self._pool
+
+    def _start(self):
+        self._pool = self._starting = self._warmup = None
+        try:
+            pool = ProcessPoolExecutor(
+                max_workers=self.size,
+                mp_context=_mp_context(),
+                initializer=_init_worker,
+                initargs=(self._config,),
+            )
+            self._warmup = pool.submit(_ready)
+        except (OSError, NotImplementedError, RuntimeError) as e:
+            self._unavailable(e)
+            return
+        self._starting = pool
+
+    def _unavailable(self, error):
+        self.app.logger.warning(
+            f"Password hashing pool failed to start ({type(error).__name__}), "
+            f"hashing inline in process {os.getpid()}. Scripts that create the app "
+            f'must run under `if __name__ == "__main__":`'
+        )
+
+
+def default_pool_size():
+    """Split the CPUs between the uwsgi workers, each of which runs a pool."""
+    try:
+        import uwsgi
+
+        workers = uwsgi.numproc
+    except (ImportError, AttributeError):
+        workers = 1
+    return max(1, (os.cpu_count() or 1) // max(workers, 1))
+
+
+def _mp_context():
+    # forkserver children fork from a clean single-threaded server process;
+    # spawn is the fallback where forkserver is unavailable (Windows)
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context(
+        "forkserver" if "forkserver" in methods else "spawn"
+    )
+
+
+def time_hash(scheme, rounds, samples=3):
+    """Median seconds to hash one password with `scheme` at `rounds`."""
+    handler = get_crypt_handler(scheme).using(rounds=rounds)
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        handler.hash("calibration-password")
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)[len(timings) // 2]
+
+
+def calibrate(scheme, target, samples=3):
+    """Find the highest cost for `scheme` that hashes within `target` seconds.
+
+    Returns (rounds, seconds, timings), where timings lists every
+    (rounds, seconds) measured. bcrypt's cost is a power of two, so each step
+    up is measured until the target is passed; linear schemes such as pbkdf2
+    are measured once and scaled.
+    """
+    handler = get_crypt_handler(scheme)
+    if getattr(handler, "rounds_cost", None) == "log2":
+        timings = []
+        rounds = handler.min_rounds
+        while rounds <= handler.max_rounds:
+            seconds = time_hash(scheme, rounds, samples)
+            timings.append((rounds, seconds))
+            if seconds > target:
+                break
+            rounds += 1
+        # The last cost within budget, or the minimum if even that is too slow
+        fits = [t for t in timings if t[1] <= target] or timings[:1]
+        return (*fits[-1], timings)
+
+    probe = handler.default_rounds
+    seconds = time_hash(scheme, probe, samples)
+    rounds = int(probe * target / seconds)
+    rounds = max(handler.min_rounds, min(rounds, handler.max_rounds))
+    estimate = seconds * rounds / probe
+    return rounds, estimate, [(probe, seconds)]
+
+
+def hash_report(batch_size=1000):
+    """Count users by password scheme and cost.
+
+    Returns a list of (scheme, rounds, users, outdated) rows, where outdated
+    means the hash will be upgraded on that user's next successful login.
+    Users without a password are reported with scheme None.
+    """
+    from enferno.extensions import db
+    from enferno.user.models import User
+
+    context = current_app.extensions["security"].pwd_context
+    counts = Counter()
+    query = db.select(User.password).execution_options(yield_per=batch_size)
+    for password in db.session.scalars(query):
+        if not password:
+            counts[(None, None, False)] += 1
+            continue
+        scheme = context.identify(password)
+        try:
+            rounds = context.handler(scheme).from_string(password).rounds
+        except (AttributeError, ValueError):
+            rounds = None
+        counts[(scheme, rounds, context.needs_update(password))] += 1
+
+    return sorted(
+        (
+            (scheme, rounds, users, outdated)
+            for (scheme, rounds, outdated), users in counts.items()
+        ),
+        key=lambda row: (row[3], row[0] or "", row[1] or 0),
+    )
@@ -0,0 +1,189 @@
+from flask_security import SQLAlchemyUserDatastore
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+
+IDENTITY_TTL = 60
+
+# Tables a snapshot is built from where any write invalidates every snapshot.
+# The user table is versioned per user instead, since every sign-in writes the
+# trackable columns of one user and must not invalidate everyone else
+IDENTITY_TABLES = ("role", "roles_users")
+
+# Bumped by set-based UPDATE/DELETE statements on the user table, which don't
+# say which users they touch
+ALL_USERS = "identity:all"
+
+# Never copied into the cache; loaded from the database if something reads them
+SECRET_COLUMNS = {"password", "tf_totp_secret", "mf_recovery_codes"}
+
+
+class IdentityCache:
+    """Loads the signed-in user and their roles without querying, most of the
+    time.
+
+    Every authenticated request looks its user up by fs_uniquifier and then
+    checks roles. The first lookup stores a snapshot of the user's columns
+    (minus SECRET_COLUMNS) and roles in the shared cache, for
+    IDENTITY_CACHE_TTL seconds; later ones rebuild the user from it and
+    attach it to the session as if it had been loaded, roles included. It
+    then lives for the rest of the request like any loaded user, so role
+    checks don't query either.
+
+    A snapshot records the versions of IDENTITY_TABLES, ALL_USERS and its
+    own user it was built at and is discarded when any has moved on. A user's
+    version is bumped when a commit updates or deletes that user through the
+    ORM, so a password or uniquifier change or a deactivation is seen on the
+    next request, while another user signing in leaves the snapshot alone.
+    Role changes and grants, and UPDATE/DELETE statements on the user table
+    run through the session (bulk operations, imports), invalidate all
+    snapshots. logout_other_sessions drops the user's snapshot explicitly.
+    IDENTITY_CACHE_TTL = 0 turns the cache off.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.ttl = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from enferno.extensions import metrics
+        from enferno.user.models import User
+        from enferno.utils.versions import TRACKED_TABLES
+
+        self.app = app
+        self.ttl = app.config.get("IDENTITY_CACHE_TTL", IDENTITY_TTL)
+        TRACKED_TABLES.update(IDENTITY_TABLES)
+        for name in ("after_update", "after_delete"):
+            if not event.contains(User, name, _user_changed):
+                event.listen(User, name, _user_changed)
+        metrics.register(
+            "identity_cache_total", "counter", "Signed-in user lookups by result"
+        )
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def load(self, fs_uniquifier):
+        """The user with this fs_uniquifier, from a snapshot when one is current."""
+        from enferno.extensions import cache, db, metrics
+        from enferno.user.models import User
+        from enferno.utils.versions import table_versions
+
+        # Read before querying, so a write racing with the load can only
+        # leave a snapshot that is already outdated
+        versions = table_versions(
+            *IDENTITY_TABLES, ALL_USERS, _version_name(fs_uniquifier)
+        )
+        snapshot = cache.get(_key(fs_uniquifier))
+        if snapshot is not None and snapshot["versions"] == versions:
+            metrics.inc("identity_cache_total", {"result": "hit"})
+            return self._restore(snapshot)
+
+        metrics.inc("identity_cache_total", {"result": "miss"})
+        user = db.session.scalar(
+            db.select(User)
+            .options(selectinload(User.roles))
+            .where(User.fs_uniquifier == fs_uniquifier)
+        )
+        if user is not None:
+            cache.set(_key(fs_uniquifier), _snapshot(user, versions), timeout=self.ttl)
+        return user
+
+    def forget(self, user):
+        """Drop the snapshot of `user`, so the next request loads it afresh."""
+        from enferno.extensions import cache
+
+        cache.delete(_key(user.fs_uniquifier))
+
+    def _restore(self, snapshot):
+        from enferno.extensions import db
+        from enferno.user.models import Role, User
+        from enferno.utils.base import detached
+
+        roles = [detached(Role, columns) for columns in snapshot["roles"]]
+        user = detached(User, snapshot["user"])
+        set_committed_value(user, "roles", roles)
+        # Adopts the objects as loaded (no SQL, nothing dirty), or returns the
+        # instance already in this session
+        return db.session.merge(user, load=False)
+
+
+class CachingUserDatastore(SQLAlchemyUserDatastore):
+    """Flask-Security's datastore, with fs_uniquifier lookups (the session and
+    token loaders) served by the identity cache."""
+
+    def find_user(self, case_insensitive=False, **kwargs):
+        from enferno.extensions import identity
+
+        if (
+            identity.enabled
+            and not case_insensitive
+            and list(kwargs) == ["fs_uniquifier"]
+        ):
+            return identity.load(str(kwargs["fs_uniquifier"]))
+        return super().find_user(case_insensitive, **kwargs)
+
+
+def _key(fs_uniquifier):
+    return f"identity:{fs_uniquifier}"
+
+
+def _version_name(fs_uniquifier):
+    # table_versions/bump_versions work for any name, not just tables
+    return f"identity-user:{fs_uniquifier}"
+
+
+def _user_changed(mapper, connection, user):
+    changed = Session.object_session(user).info.setdefault("identity_changed", set())
+    changed.add(user.fs_uniquifier)
+    # A new uniquifier must also retire the snapshot kept under the old one
+    changed.update(inspect(user).attrs.fs_uniquifier.history.deleted)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_statements(orm_execute_state):
+    statement = orm_execute_state.statement
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and getattr(
+        statement.table, "name", None
+    ) == "user":
+        orm_execute_state.session.info["identity_changed_all"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_changed(session):
+    from enferno.utils.versions import bump_versions
+
+    # After the commit, so a concurrent load can't snapshot the old row under
+    # the new version
+    changed = session.info.pop("identity_changed", None)
+    if changed:
+        bump_versions(*(_version_name(u) for u in changed))
+    if session.info.pop("identity_changed_all", False):
+        bump_versions(ALL_USERS)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_changed(session, previous_transaction):
+    # Keep what was recorded when only a savepoint rolled back; an extra bump
+    # costs a reload, a missing one serves a stale user
+    if previous_transaction.parent is None:
+        session.info.pop("identity_changed", None)
+        session.info.pop("identity_changed_all", None)
+
+
+def _snapshot(user, versions):
+    return {
+        "versions": versions,
+        "user": {
+            column.key: getattr(user, column.key)
+            for column in user.__table__.columns
+            if column.key not in SECRET_COLUMNS
+        },
+        "roles": [
+            {column.key: getattr(role, column.key) for column in role.__table__.columns}
+            for role in user.roles
+        ],
+    }
@@ -0,0 +1,82 @@
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateIndex
+
+from enferno.extensions import db
+
+
+def create_missing_indexes():
+    """Create the models' indexes that are missing from existing tables.
+
+    create_all() only creates indexes together with their table, so an index
+    added to a model later never reaches a database whose table already
+    exists. On PostgreSQL each one is built with CREATE INDEX CONCURRENTLY IF
+    NOT EXISTS, so reads and writes carry on while it builds; an invalid index
+    left behind by an interrupted build is dropped and built again.
+    Partitioned tables can't be indexed concurrently, so they get a plain
+    CREATE INDEX, as do other databases such as SQLite.
+
+    Yields the name of each index after it is created.
+    """
+    engine = db.engine.execution_options(isolation_level="AUTOCOMMIT")
+    with engine.connect() as conn:
+        inspector = inspect(conn)
+        postgres = conn.dialect.name == "postgresql"
+        for table in db.metadata.sorted_tables:
+            if not table.indexes or not inspector.has_table(table.name):
+                continue
+            if postgres:
+                partitioned = (
+                    conn.execute(
+                        db.text(
+                            "SELECT relkind FROM pg_class WHERE oid = to_regclass(:t)"
+                        ),
+                        {"t": table.name},
+                    ).scalar()
+                    == "p"
+                )
+            elif conn.dialect.name == "sqlite":
+                # Reflection leaves out expression indexes
+                existing = set(
+                    conn.execute(
+                        db.text(
+                            "SELECT name FROM sqlite_master "
+                            "WHERE type = 'index' AND tbl_name = :t"
+                        ),
+                        {"t": table.name},
+                    ).scalars()
+                )
+            else:
+                existing = {
+                    index["name"] for index in inspector.get_indexes(table.name)
+                }
+
+            for index in sorted(table.indexes, key=lambda index: index.name):
+                if not postgres:
+                    if index.name not in existing:
+                        index.create(conn)
+                        yield index.name
+                    continue
+
+                valid = conn.execute(
+                    db.text(
+                        "SELECT indisvalid FROM pg_index "
+                        "WHERE indexrelid = to_regclass(:i)"
+                    ),
+                    {"i": index.name},
+                ).scalar()
+                if valid:
+                    continue
+                if partitioned:
+                    index.create(conn)
+                    yield index.name
+                    continue
+                if valid is False:
+                    conn.execute(db.text(f"DROP INDEX CONCURRENTLY {index.name}"))
+                conn.execute(db.text(_create_concurrently(conn, index)))
+                yield index.name
+
+
+def _create_concurrently(conn, index):
+    # The dialect's own CREATE INDEX, which handles expression indexes too
+    ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=conn.dialect))
+    return ddl.replace("INDEX", "INDEX CONCURRENTLY", 1)
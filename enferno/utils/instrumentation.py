@@ -0,0 +1,167 @@
+import heapq
+from time import perf_counter
+
+from flask import (
+    before_render_template,
+    g,
+    has_request_context,
+    request,
+    request_started,
+    template_rendered,
+)
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SLOWEST_QUERIES = 5
+
+
+class RequestTiming:
+    """Timings collected for a single request, all in milliseconds."""
+
+    __slots__ = (
+        "start",
+        "db_count",
+        "db_ms",
+        "template_ms",
+        "template_starts",
+        "slowest",
+    )
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.db_count = 0
+        self.db_ms = 0.0
+        self.template_ms = 0.0
+        self.template_starts = []
+        # Min-heap of (ms, statement) holding the slowest queries seen
+        self.slowest = []
+
+    @property
+    def total_ms(self):
+        return (perf_counter() - self.start) * 1000
+
+    def handler_ms(self, total_ms):
+        """Time spent in Python outside the database and templates."""
+        return max(total_ms - self.db_ms - self.template_ms, 0.0)
+
+
+class Instrumentation:
+    """Always-on per-request SQL and timing instrumentation.
+
+    Counts queries and DB time through engine events, template time through
+    Flask's render signals. Requests slower than SLOW_REQUEST_MS are logged
+    with their endpoint, breakdown and slowest SQL statements.
+
+    With SERVER_TIMING_HEADER on, the breakdown is also sent in a
+    `Server-Timing` header (visible in browser dev tools), but only in debug
+    mode or to signed-in admins: query counts and timings on anonymous pages
+    such as login would leak which accounts exist.
+
+    The work per query is two perf_counter() calls and a small heap update, so
+    it is cheap enough to leave on in production.
+    """
+
+    _engine_hooked = False
+
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        if not app.config.get("INSTRUMENTATION_ENABLED", True):
+            return
+
+        request_started.connect(self._request_started, app)
+        before_render_template.connect(self._template_started, app)
+        template_rendered.connect(self._template_rendered, app)
+        app.after_request(self._after_request)
+
+        # Engines are created lazily per app, so hook the class once
+        if not Instrumentation._engine_hooked:
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+            event.listen(Engine, "handle_error", _handle_error)
+            Instrumentation._engine_hooked = True
+
+    def _request_started(self, sender, **extra):
+        g._timing = RequestTiming()
+
+    def _template_started(self, sender, **extra):
+        timing = g.get("_timing")
+        if timing is not None:
+            timing.template_starts.append(perf_counter())
+
+    def _template_rendered(self, sender, **extra):
+        timing = g.get("_timing")
+        if timing is not None and timing.template_starts:
+            started = timing.template_starts.pop()
+            # Only count the outermost render so nested templates aren't doubled
+            if not timing.template_starts:
+                timing.template_ms += (perf_counter() - started) * 1000
+
+    def _after_request(self, response):
+        timing = g.get("_timing")
+        if timing is None:
+            return response
+
+        total_ms = timing.total_ms
+        handler_ms = timing.handler_ms(total_ms)
+        if self.app.config.get("SERVER_TIMING_HEADER", False) and self._may_see():
+            response.headers["Server-Timing"] = ", ".join(
+                [
+                    f'db;dur={timing.db_ms:.1f};desc="{timing.db_count} queries"',
+                    f"tpl;dur={timing.template_ms:.1f}",
+                    f"app;dur={handler_ms:.1f}",
+                    f"total;dur={total_ms:.1f}",
+                ]
+            )
+
+        if total_ms >= self.app.config.get("SLOW_REQUEST_MS", 500):
+            slowest = "\n".join(
+                f"  {ms:.1f}ms {statement}"
+                for ms, statement in sorted(timing.slowest, reverse=True)
+            )
+            self.app.logger.warning(
+                f"Slow request {request.method} {request.path} "
+                f"({request.endpoint}): {total_ms:.1f}ms total, "
+                f"{timing.db_ms:.1f}ms in {timing.db_count} queries, "
+                f"{timing.template_ms:.1f}ms templates, {handler_ms:.1f}ms handler\n"
+                f"{slowest}"
+            )
+        return response
+
+    def _may_see(self):
+        if self.app.debug:
+            return True
+        return current_user.is_authenticated and current_user.has_role("admin")
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_start"].pop()
+    if not has_request_context():
+        return
+    timing = g.get("_timing")
+    if timing is None:
+        return
+
+    ms = (perf_counter() - started) * 1000
+    timing.db_count += 1
+    timing.db_ms += ms
+    if len(timing.slowest) < SLOWEST_QUERIES:
+        heapq.heappush(timing.slowest, (ms, statement))
+    elif ms > timing.slowest[0][0]:
+        heapq.heapreplace(timing.slowest, (ms, statement))
+
+
+def _handle_error(context):
+    # after_cursor_execute never fires for a failed statement
+    starts = context.connection.info.get("query_start") if context.connection else None
+    if starts:
+        starts.pop()
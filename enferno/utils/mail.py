@@ -0,0 +1,384 @@
+import atexit
+import heapq
+import itertools
+import os
+import queue
+import smtplib
+import socketserver
+import threading
+import time
+from contextlib import nullcontext
+
+from flask import g, has_app_context
+from flask_security.mail_util import MailUtil
+
+MESSAGE_FIELDS = ("subject", "sender", "recipients", "cc", "bcc", "reply_to")
+
+
+def message_to_dict(message):
+    """The fields of a flask_mail Message the outbox can carry (no attachments)."""
+    data = {field: getattr(message, field) for field in MESSAGE_FIELDS}
+    data["body"], data["html"] = message.body, message.html
+    return data
+
+
+def is_permanent(error):
+    """True for failures a retry won't fix: 5xx replies and invalid messages."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    # Anything else at the socket level (timeouts, disconnects) is transient
+    return not isinstance(error, OSError)
+
+
+class MailOutbox:
+    """Sends mail outside the request, in batches over one SMTP connection.
+
+    MAIL_OUTBOX_MODE selects how:
+
+    - "celery": messages queued during a request, CLI command or task are
+      handed to the send_mail task when its app context tears down, up to
+      MAIL_BATCH_SIZE per task. The default when a Celery broker is set.
+    - "thread": a background thread per worker sends them. The default
+      otherwise, and the fallback when the broker can't be reached.
+    - "sync": send immediately, for scripts and debugging.
+
+    Each process keeps its SMTP connection open between batches and closes
+    it after MAIL_IDLE_TIMEOUT idle seconds. Transient failures (4xx
+    replies, dropped connections) are retried MAIL_MAX_RETRIES times, waiting
+    MAIL_RETRY_BACKOFF seconds, doubled on every attempt; permanent ones
+    (5xx) are logged and dropped.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._queue = queue.Queue()
+        self._retries = []
+        self._sequence = itertools.count()
+        self._lock = threading.RLock()
+        self._thread = None
+        self._pid = None
+        self._connection = None
+        self._connection_pid = None
+        self._last_used = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Call after Flask-Mail has been initialised."""
+        from enferno.extensions import metrics
+
+        self.app = app
+        self.mode = app.config.get("MAIL_OUTBOX_MODE", "thread")
+        self.batch_size = app.config.get("MAIL_BATCH_SIZE", 50)
+        self.idle_timeout = app.config.get("MAIL_IDLE_TIMEOUT", 30)
+        self.max_retries = app.config.get("MAIL_MAX_RETRIES", 5)
+        self.retry_backoff = app.config.get("MAIL_RETRY_BACKOFF", 2.0)
+
+        if self.mode == "celery":
+            app.teardown_appcontext(lambda exc: self.dispatch())
+        metrics.register(
+            "mail_messages_total", "counter", "Outgoing mail messages by result"
+        )
+        atexit.register(self.shutdown)
+
+    @property
+    def pending(self):
+        return self._queue.qsize() + len(self._retries)
+
+    def send(self, message):
+        """Queue a flask_mail Message, or a dict of its fields, for sending."""
+        data = message if isinstance(message, dict) else message_to_dict(message)
+        if self.mode == "sync":
+            self.drop(self.deliver([data]))
+        elif self.mode == "celery" and has_app_context():
+            g.setdefault("_mail_outbox", []).append(data)
+        else:
+            self._queue.put((0, data))
+            self._ensure_thread()
+
+    def dispatch(self):
+        """Hand the messages queued in this app context to Celery."""
+        messages = g.pop("_mail_outbox", None)
+        if not messages:
+            return
+        try:
+            from enferno.tasks import send_mail
+
+            for start in range(0, len(messages), self.batch_size):
+                send_mail.delay(messages[start : start + self.batch_size])
+        except Exception as e:
+            self.app.logger.error(f"Mail task enqueue failed, sending in process: {e}")
+            for data in messages:
+                self._queue.put((0, data))
+            self._ensure_thread()
+
+    def deliver(self, messages):
+        """Send message dicts over this process's SMTP connection.
+
+        Permanent failures are logged and dropped. Returns the messages that
+        failed transiently and are worth retrying.
+        """
+        from enferno.extensions import metrics
+
+        retry = []
+        ctx = nullcontext() if has_app_context() else self.app.app_context()
+        with self._lock, ctx:
+            for data in messages:
+                try:
+                    self._send(data)
+                except Exception as e:
+                    if is_permanent(e):
+                        self.app.logger.error(
+                            f"Mail to {data.get('recipients')} failed: {e}"
+                        )
+                        metrics.inc("mail_messages_total", {"result": "failed"})
+                    else:
+                        if not isinstance(e, smtplib.SMTPResponseException):
+                            # The connection may be half broken; start over
+                            self.close()
+                        retry.append(data)
+                else:
+                    metrics.inc("mail_messages_total", {"result": "sent"})
+        return retry
+
+    def drop(self, messages):
+        """Log messages that ran out of retries."""
+        from enferno.extensions import metrics
+
+        for data in messages:
+            self.app.logger.error(
+                f"Mail to {data.get('recipients')} dropped after retries: "
+                f"{data.get('subject')!r}"
+            )
+            metrics.inc("mail_messages_total", {"result": "dropped"})
+
+    def backoff(self, attempt):
+        """Seconds to wait before retry number `attempt` (0-based)."""
+        return self.retry_backoff * 2**attempt
+
+    def flush(self):
+        """Send everything queued in this process now, without retrying."""
+        while batch := self._drain():
+            self.drop(self.deliver([data for _, data in batch]))
+
+    def close(self):
+        with self._lock:
+            connection, self._connection = self._connection, None
+            if connection is not None and connection.host is not None:
+                try:
+                    connection.host.quit()
+                except Exception:
+                    pass
+
+    def shutdown(self):
+        if self.app is not None and self.pending:
+            # Everything is due now; this is the last chance to send it
+            self._retries = [(0, *item[1:]) for item in self._retries]
+            self.flush()
+        self.close()
+
+    def _send(self, data):
+        from flask_mail import Message
+
+        data = dict(data)
+        if isinstance(data.get("sender"), list):
+            # A (name, address) pair that went through JSON
+            data["sender"] = tuple(data["sender"])
+        message = Message(**data)
+        try:
+            self._connect().send(message)
+        except smtplib.SMTPServerDisconnected:
+            # The server closed the pooled connection; reconnect once
+            self._connection = None
+            self._connect().send(message)
+        self._last_used = time.monotonic()
+
+    def _connect(self):
+        from flask_mail import Connection
+
+        if (
+            self._connection is not None
+            and self._connection_pid == os.getpid()
+            and time.monotonic() - self._last_used < self.idle_timeout
+        ):
+            return self._connection
+        if self._connection_pid == os.getpid():
+            self.close()
+
+        mail = self.app.extensions["mail"]
+        connection = Connection(mail)
+        connection.host = None if mail.suppress else connection.configure_host()
+        self._connection, self._connection_pid = connection, os.getpid()
+        self._last_used = time.monotonic()
+        return connection
+
+    def _drain(self, wait=None):
+        """Up to batch_size (attempt, message) pairs: retries that are due,
+        then queued messages, blocking up to `wait` seconds for the first."""
+        batch = []
+        now = time.monotonic()
+        while self._retries and self._retries[0][0] <= now:
+            _, _, attempt, data = heapq.heappop(self._retries)
+            batch.append((attempt, data))
+        try:
+            if not batch and wait:
+                batch.append(self._queue.get(timeout=wait))
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _ensure_thread(self):
+        # Threads don't survive fork, so each (uwsgi) worker starts its own lazily
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._retries = []
+                self._thread = threading.Thread(
+                    target=self._run, name="mail-outbox", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                wait = self.idle_timeout
+                if self._retries:
+                    wait = min(wait, max(self._retries[0][0] - time.monotonic(), 0))
+                batch = self._drain(wait=wait or 0.001)
+                if not batch:
+                    if not self._retries:
+                        self.close()
+                    continue
+
+                attempts = {id(data): attempt for attempt, data in batch}
+                failed = self.deliver([data for _, data in batch])
+                for data in failed:
+                    attempt = attempts[id(data)]
+                    if attempt >= self.max_retries:
+                        self.drop([data])
+                        continue
+                    due = time.monotonic() + self.backoff(attempt)
+                    heapq.heappush(
+                        self._retries,
+                        (due, next(self._sequence), attempt + 1, data),
+                    )
+
+
+class OutboxMailUtil(MailUtil):
+    """Flask-Security's mail utility, sending through the outbox when it is
+    set up (MAIL_SERVER configured) instead of inline in the request."""
+
+    def send_mail(self, template, subject, recipient, sender, body, html, **kwargs):
+        from enferno.extensions import outbox
+
+        if outbox.app is None:
+            return super().send_mail(
+                template, subject, recipient, sender, body, html, **kwargs
+            )
+        # The sender can be a lazy string or a (name, address) pair of them
+        if isinstance(sender, tuple) and len(sender) == 2:
+            sender = (str(sender[0]), str(sender[1]))
+        else:
+            sender = str(sender)
+        outbox.send(
+            {
+                "subject": str(subject),
+                "sender": sender,
+                "recipients": [recipient],
+                "body": body,
+                "html": html,
+            }
+        )
+
+
+class LocalSMTPServer:
+    """A minimal SMTP server for development and tests.
+
+    Accepts every message (no TLS or auth) and keeps them in `messages` as
+    (sender, recipients, data) tuples; `connections` counts client
+    connections. Setting `fail_next` makes that many messages fail with a
+    451 reply, to exercise retries. Use as a context manager to run it in a
+    background thread:
+
+        with LocalSMTPServer() as server:
+            app.config.update(MAIL_SERVER=server.host, MAIL_PORT=server.port,
+                              MAIL_USE_SSL=False)
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, on_message=None):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                server._session(self.rfile, self.wfile)
+
+        self._server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.host, self.port = self._server.server_address[:2]
+        self.on_message = on_message
+        self.messages = []
+        self.connections = 0
+        self.fail_next = 0
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _session(self, rfile, wfile):
+        def reply(line):
+            wfile.write(f"{line}\r\n".encode())
+
+        self.connections += 1
+        reply("220 localhost SMTP stand-in")
+        sender, recipients = None, []
+        for raw in rfile:
+            command = raw.decode("utf-8", "replace").strip()
+            verb = command[:4].upper()
+            if verb in ("HELO", "EHLO"):
+                reply("250 localhost")
+            elif verb == "MAIL":
+                sender, recipients = _address(command), []
+                reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(_address(command))
+                reply("250 OK")
+            elif verb == "DATA":
+                reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                for line in rfile:
+                    if line.rstrip(b"\r\n") == b".":
+                        break
+                    lines.append(line[1:] if line.startswith(b"..") else line)
+                if self.fail_next:
+                    self.fail_next -= 1
+                    reply("451 Try again later")
+                    continue
+                self.messages.append((sender, recipients, b"".join(lines)))
+                if self.on_message:
+                    self.on_message(*self.messages[-1])
+                reply("250 OK")
+            elif verb in ("RSET", "NOOP"):
+                reply("250 OK")
+            elif verb == "QUIT":
+                reply("221 Bye")
+                return
+            else:
+                reply("502 Command not implemented")
+
+
+def _address(command):
+    # "MAIL FROM:<a@example.com> SIZE=123" -> "a@example.com"
+    return command.partition("<")[2].partition(">")[0]
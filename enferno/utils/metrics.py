@@ -0,0 +1,403 @@
+import atexit
+import glob
+import hmac
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+from flask import Response, abort, current_app, g, request, request_started
+from sqlalchemy.pool import QueuePool
+
+from enferno.utils.cache import TieredCache
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+HTTP_METHODS = frozenset(("GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"))
+
+
+class MmapValues:
+    """Float values keyed by sample name, in an mmap'd file owned by one process.
+
+    Layout: an 8 byte header holding the number of bytes used, followed by
+    entries of [int32 key length][utf-8 key][padding to 8 bytes][float64]. New
+    keys are appended and the header is updated last, so readers in other
+    processes never see a half-written entry.
+    """
+
+    def __init__(self, path, size=64 * 1024):
+        self._file = open(path, "a+b")
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._file.truncate(size)
+        self._capacity = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), self._capacity)
+        self._used = struct.unpack_from("q", self._map, 0)[0] or 8
+        self._positions = {
+            key: pos for key, _, pos in _read_entries(self._map, self._used)
+        }
+
+    def add(self, key, amount):
+        pos = self._position(key)
+        value = struct.unpack_from("d", self._map, pos)[0]
+        struct.pack_into("d", self._map, pos, value + amount)
+
+    def set(self, key, value):
+        struct.pack_into("d", self._map, self._position(key), value)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def _position(self, key):
+        pos = self._positions.get(key)
+        if pos is None:
+            encoded = key.encode()
+            padding = 8 - (4 + len(encoded)) % 8
+            entry = struct.pack(
+                f"i{len(encoded)}s{padding}xd", len(encoded), encoded, 0
+            )
+            while self._used + len(entry) > self._capacity:
+                self._capacity *= 2
+                self._file.truncate(self._capacity)
+                self._map = mmap.mmap(self._file.fileno(), self._capacity)
+            self._map[self._used : self._used + len(entry)] = entry
+            pos = self._used + len(entry) - 8
+            self._used += len(entry)
+            struct.pack_into("q", self._map, 0, self._used)
+            self._positions[key] = pos
+        return pos
+
+
+def _read_entries(data, used):
+    pos = 8
+    while pos < used:
+        length = struct.unpack_from("i", data, pos)[0]
+        key = bytes(data[pos + 4 : pos + 4 + length]).decode()
+        pos += 4 + length + 8 - (4 + length) % 8
+        yield key, struct.unpack_from("d", data, pos)[0], pos
+        pos += 8
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long callers wait to check out a connection."""
+
+    def _do_get(self):
+        started = perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            from enferno.extensions import metrics
+
+            metrics.observe(
+                "db_pool_checkout_wait_seconds", {}, perf_counter() - started
+            )
+
+
+class InstrumentedCache:
+    """Wraps a flask-caching backend to count hits and misses on reads."""
+
+    def __init__(self, backend, metrics):
+        self._backend = backend
+        self._metrics = metrics
+
+    def get(self, key):
+        value = self._backend.get(key)
+        self._metrics.inc(
+            "cache_requests_total", {"result": "miss" if value is None else "hit"}
+        )
+        return value
+
+    def get_many(self, *keys):
+        values = self._backend.get_many(*keys)
+        hits = sum(value is not None for value in values)
+        self._metrics.inc("cache_requests_total", {"result": "hit"}, hits)
+        self._metrics.inc("cache_requests_total", {"result": "miss"}, len(keys) - hits)
+        return values
+
+    def __getattr__(self, name):
+        return getattr(self._backend, name)
+
+
+class Metrics:
+    """Prometheus metrics aggregated across (uwsgi) worker processes.
+
+    Every process writes its own samples to an mmap'd file in METRICS_DIR;
+    `/metrics` reads and sums the files of all workers, so whichever worker
+    answers the scrape reports the whole instance. Counters and histograms of
+    processes that have exited are folded into one `merged.db` file, by the
+    process itself at exit or by the next process to start the app if it
+    was killed, so totals never go backwards and files don't pile up; gauges
+    only include live processes.
+
+    Scrapes must carry `Authorization: Bearer <METRICS_TOKEN>`, or come from
+    one of METRICS_ALLOWED_IPS when no token is configured. The allow-list is
+    empty by default: behind a reverse proxy on the same host every public
+    request arrives from 127.0.0.1, so `/metrics` answers 404 until one of
+    the two is set.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.families = {}
+        self._values = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+        self.register("http_requests_total", "counter", "HTTP requests by status")
+        self.register(
+            "http_request_duration_seconds", "histogram", "HTTP request latency"
+        )
+        self.register(
+            "db_pool_checkout_wait_seconds",
+            "histogram",
+            "Time spent waiting for a pooled DB connection",
+            buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+        )
+        self.register(
+            "cache_requests_total", "counter", "Cache reads by (tier and) result"
+        )
+        self.register("audit_queue_depth", "gauge", "Audit rows waiting to be written")
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Call after cache.init_app and before db.init_app."""
+        self.app = app
+        if not app.config.get("METRICS_ENABLED", True):
+            return
+
+        self.directory = app.config.get("METRICS_DIR") or os.path.join(
+            tempfile.gettempdir(), "enferno-metrics"
+        )
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Time connection checkouts, unless the database uses its own pool class
+        options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+        uri = app.config.get("SQLALCHEMY_DATABASE_URI", "")
+        if "poolclass" not in options and ":memory:" not in uri and uri != "sqlite://":
+            options["poolclass"] = TimedQueuePool
+
+        for cache_ext, backend in app.extensions.get("cache", {}).items():
+            # The tiered cache counts hits and misses per tier itself
+            if not isinstance(backend, TieredCache):
+                app.extensions["cache"][cache_ext] = InstrumentedCache(backend, self)
+
+        self._fold(
+            path
+            for path, pid in self._worker_files()
+            if pid != os.getpid() and not _pid_alive(pid)
+        )
+        atexit.register(self._retire)
+
+        request_started.connect(self._request_started, app)
+        app.after_request(self._after_request)
+        # Requests whose exception escaped the error handlers skip after_request
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule("/metrics", "metrics", self._view)
+
+    def register(self, name, kind, help, buckets=DEFAULT_BUCKETS):
+        self.families[name] = (kind, help, buckets)
+
+    def inc(self, name, labels, amount=1):
+        self._write("add", _sample(name, labels), amount)
+
+    def set(self, name, labels, value):
+        self._write("set", _sample(name, labels), value)
+
+    def observe(self, name, labels, value):
+        buckets = self.families[name][2]
+        # Buckets are cumulative; write every one so empty buckets still export
+        for bound in buckets:
+            self.inc(
+                f"{name}_bucket", {**labels, "le": str(bound)}, int(value <= bound)
+            )
+        self.inc(f"{name}_bucket", {**labels, "le": "+Inf"})
+        self.inc(f"{name}_sum", labels, value)
+        self.inc(f"{name}_count", labels)
+
+    def _write(self, op, key, value):
+        if self.app is None or not self.app.config.get("METRICS_ENABLED", True):
+            return
+        with self._lock:
+            # Each process (including forked workers) gets its own file
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._values = MmapValues(
+                    os.path.join(self.directory, f"worker-{self._pid}.db")
+                )
+            getattr(self._values, op)(key, value)
+
+    def collect(self):
+        """Sum samples across all worker files. Returns {sample: value}."""
+        totals = {}
+        files = [(path, _pid_alive(pid)) for path, pid in self._worker_files()]
+        files.append((os.path.join(self.directory, "merged.db"), False))
+        with self._locked(shared=True):
+            for path, alive in files:
+                for key, value in _samples(path):
+                    if not alive and self._kind(key) == "gauge":
+                        continue
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def _worker_files(self):
+        for path in glob.glob(os.path.join(self.directory, "worker-*.db")):
+            yield path, int(re.search(r"worker-(\d+)\.db$", path)[1])
+
+    def _fold(self, paths):
+        """Add the counters and histograms in `paths` to merged.db and delete
+        them. Their gauges are dropped, as they would be once the process is
+        gone anyway."""
+        with self._locked():
+            merged = None
+            for path in paths:
+                if merged is None:
+                    merged = MmapValues(os.path.join(self.directory, "merged.db"))
+                for key, value in _samples(path):
+                    if self._kind(key) != "gauge":
+                        merged.add(key, value)
+                os.remove(path)
+            if merged is not None:
+                merged.close()
+
+    def _retire(self):
+        with self._lock:
+            if self._values is None or self._pid != os.getpid():
+                return
+            self._values.close()
+            self._values, self._pid = None, None
+            self._fold([os.path.join(self.directory, f"worker-{os.getpid()}.db")])
+
+    @contextmanager
+    def _locked(self, shared=False):
+        # Keeps a scrape from counting a file both before and after it is folded
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, ".lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield
+
+    def render(self):
+        """Render all samples in the Prometheus text exposition format."""
+        samples = self.collect()
+        lines = []
+        for name, (kind, help, _) in self.families.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            # Samples keep the order they were first written, buckets ascending
+            lines.extend(
+                f"{key} {value:g}"
+                for key, value in samples.items()
+                if _family(key) == name
+            )
+        return "\n".join(lines) + "\n"
+
+    def _kind(self, key):
+        family = self.families.get(_family(key))
+        return family[0] if family else None
+
+    def _request_started(self, sender, **extra):
+        g._metrics_start = perf_counter()
+
+    def _after_request(self, response):
+        self._record(response.status_code)
+        return response
+
+    def _teardown_request(self, exc):
+        if exc is not None:
+            self._record(500)
+
+    def _record(self, status):
+        started = g.pop("_metrics_start", None)
+        if started is None:
+            return
+
+        endpoint = request.endpoint or "none"
+        blueprint = request.blueprint or "none"
+        self.inc(
+            "http_requests_total",
+            {
+                "endpoint": endpoint,
+                "method": _method(request.method),
+                "status": str(status),
+            },
+        )
+        self.observe(
+            "http_request_duration_seconds",
+            {"blueprint": blueprint, "endpoint": endpoint},
+            perf_counter() - started,
+        )
+
+        from enferno.extensions import audit
+
+        self.set("audit_queue_depth", {}, audit.pending)
+
+    def _view(self):
+        token = current_app.config.get("METRICS_TOKEN")
+        if token:
+            provided = request.headers.get("Authorization", "").removeprefix("Bearer ")
+            if not hmac.compare_digest(provided.encode(), token.encode()):
+                abort(404)
+        elif request.remote_addr not in current_app.config.get(
+            "METRICS_ALLOWED_IPS", []
+        ):
+            abort(404)
+        return Response(self.render(), content_type="text/plain; version=0.0.4")
+
+
+def _method(method):
+    # Clients can send any method token; keep the label set bounded
+    return method if method in HTTP_METHODS else "other"
+
+
+def _samples(path):
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return
+    if len(data) < 8:
+        return
+    used = struct.unpack_from("q", data, 0)[0]
+    for key, value, _ in _read_entries(data, used):
+        yield key, value
+
+
+def _sample(name, labels):
+    if not labels:
+        return name
+    pairs = ",".join(
+        f'{key}="{_escape(str(value))}"' for key, value in sorted(labels.items())
+    )
+    return f"{name}{{{pairs}}}"
+
+
+def _escape(value):
+    return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _family(key):
+    name = key.split("{", 1)[0]
+    for suffix in ("_bucket", "_sum", "_count"):
+        if name.endswith(suffix):
+            return name.removesuffix(suffix)
+    return name
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,143 @@
+import base64
+import hashlib
+from datetime import datetime
+
+import orjson as json
+from flask import current_app
+from sqlalchemy import exc, func, tuple_
+from sqlalchemy.sql.util import find_tables
+
+from enferno.extensions import cache, db
+from enferno.utils.versions import TRACKED_TABLES, table_versions
+
+COUNT_TTL = 60
+ESTIMATE_THRESHOLD = 100_000
+
+
+def encode_cursor(created_at, id):
+    """Encode a (created_at, id) position as an opaque, url-safe token."""
+    raw = json.dumps([created_at.isoformat(), id])
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """Decode a token produced by encode_cursor. Raises ValueError if malformed."""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        created_at, id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(id)
+    except (TypeError, ValueError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {token!r}") from e
+
+
+def keyset_paginate(query, created_col, id_col, per_page, after=None, before=None):
+    """Page a query newest-first by (created_at, id) without using OFFSET.
+
+    `after` continues towards older rows, `before` goes back towards newer rows.
+    Both are tokens from encode_cursor; pass neither for the first page.
+    The key columns should be covered by a composite index so each page is a
+    single index range scan regardless of how deep it is.
+
+    Returns (rows, has_older, has_newer); rows are always newest-first.
+    """
+    key = tuple_(created_col, id_col)
+
+    if before:
+        query = query.where(key > decode_cursor(before)).order_by(
+            created_col.asc(), id_col.asc()
+        )
+    else:
+        if after:
+            query = query.where(key < decode_cursor(after))
+        query = query.order_by(created_col.desc(), id_col.desc())
+
+    # Fetch one extra row to learn whether another page exists
+    rows = db.session.execute(query.limit(per_page + 1)).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if before:
+        rows.reverse()
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = bool(after), has_more
+
+    return rows, has_older, has_newer
+
+
+def paginate(query, page, per_page):
+    """Drop-in replacement for db.paginate with a cheaper `total`.
+
+    Totals are cached per query shape for PAGINATION_COUNT_TTL seconds, keyed
+    on the versions of the tables in the query (see versions.py), so any
+    committed write to one of them, ORM or Core, starts a fresh count. Unfiltered queries
+    over tables larger than PAGINATION_ESTIMATE_THRESHOLD rows use the planner's
+    row estimate instead of COUNT(*); `pagination.total_is_estimate` tells the
+    caller which one it got.
+    """
+    pagination = db.paginate(query, page=page, per_page=per_page, count=False)
+    pagination.total, pagination.total_is_estimate = query_total(query)
+    return pagination
+
+
+def query_total(query):
+    """Return (total, is_estimate) for a select, using the cache when possible."""
+    tables = sorted({t.name for t in find_tables(query, include_joins=True)})
+    # Normally registered already by the view's @conditional, at import time
+    TRACKED_TABLES.update(tables)
+
+    if query.whereclause is None and len(tables) == 1:
+        estimate = estimate_rows(tables[0])
+        threshold = current_app.config.get(
+            "PAGINATION_ESTIMATE_THRESHOLD", ESTIMATE_THRESHOLD
+        )
+        if estimate is not None and estimate >= threshold:
+            return estimate, True
+
+    key = _count_key(query, tables)
+    total = cache.get(key)
+    if total is None:
+        count_query = db.select(func.count()).select_from(
+            query.order_by(None).subquery()
+        )
+        total = db.session.execute(count_query).scalar()
+        cache.set(
+            key,
+            total,
+            timeout=current_app.config.get("PAGINATION_COUNT_TTL", COUNT_TTL),
+        )
+    return total, False
+
+
+def estimate_rows(table):
+    """Fast row estimate from planner statistics, or None if unavailable.
+
+    Postgres keeps `reltuples` up to date through autovacuum; SQLite only has
+    `sqlite_stat1` after ANALYZE has been run.
+    """
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        sql = "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:t)"
+    elif dialect == "sqlite":
+        sql = "SELECT stat FROM sqlite_stat1 WHERE tbl = :t ORDER BY idx IS NOT NULL"
+    else:
+        return None
+
+    # Use a separate connection so a failure can't roll back the caller's session
+    try:
+        with db.engine.connect() as conn:
+            value = conn.execute(db.text(sql), {"t": table}).scalar()
+    except exc.DBAPIError:
+        return None
+
+    if isinstance(value, str):
+        # sqlite_stat1.stat is "<rows> <avg rows per key> ..."
+        value = int(value.split()[0])
+    # reltuples is -1 for tables that were never analyzed
+    return value if value is not None and value >= 0 else None
+
+
+def _count_key(query, tables):
+    compiled = query.compile(db.engine)
+    shape = f"{compiled}|{sorted(compiled.params.items())}|{table_versions(*tables)}"
+    return f"count:{hashlib.sha1(shape.encode()).hexdigest()}"
@@ -0,0 +1,110 @@
+import threading
+from typing import NamedTuple
+
+
+class RoleInfo(NamedTuple):
+    """A role as the registry holds it: plain values, safe to share."""
+
+    id: int
+    name: str
+    description: str | None
+
+    @property
+    def bit(self):
+        """This role's bit in a role mask."""
+        return 1 << self.id
+
+
+def role_mask(roles):
+    """The bitmask of `roles` (Role or RoleInfo objects): bit N is role id N."""
+    mask = 0
+    for role in roles:
+        mask |= 1 << role.id
+    return mask
+
+
+class RoleRegistry:
+    """Every role, in process memory, looked up by id or name without a query.
+
+    Roles are few and rarely change, so the whole table is loaded on first
+    use and again only once a write to it has been committed, anywhere:
+    each lookup compares the table's version (see utils.versions, a cache
+    read) with the one it was loaded at. Only committed rows are loaded, on
+    a connection of its own, so a transaction's pending roles never leak
+    into other requests.
+
+    Role bits are derived from ids, so masks stay valid across reloads and
+    processes.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        # (by id, by name), swapped as a whole on reload
+        self._maps = ({}, {})
+        self._version = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from enferno.utils.versions import TRACKED_TABLES
+
+        self.app = app
+        TRACKED_TABLES.add("role")
+
+    def get(self, key):
+        """The RoleInfo for a role id or name, or None."""
+        by_id, by_name = self._current()
+        return by_name.get(key) if isinstance(key, str) else by_id.get(key)
+
+    def all(self):
+        """Every role, by id."""
+        by_id, _ = self._current()
+        return [by_id[id] for id in sorted(by_id)]
+
+    def instances(self, keys):
+        """Role models for the given ids or names, attached to the session
+        without a query. Unknown keys are skipped."""
+        from enferno.extensions import db
+        from enferno.user.models import Role
+        from enferno.utils.base import detached
+
+        found = (self.get(key) for key in keys)
+        return [
+            db.session.merge(detached(Role, info._asdict()), load=False)
+            for info in found
+            if info is not None
+        ]
+
+    def instance(self, key):
+        """The Role model for an id or name, or None."""
+        found = self.instances([key])
+        return found[0] if found else None
+
+    def _current(self):
+        from enferno.utils.versions import table_versions
+
+        [version] = table_versions("role")
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._load(version)
+        return self._maps
+
+    def _load(self, version):
+        from enferno.extensions import db
+        from enferno.user.models import Role
+
+        table = Role.__table__
+        with db.engine.connect() as conn:
+            rows = conn.execute(
+                db.select(table.c.id, table.c.name, table.c.description)
+            ).all()
+        roles = [RoleInfo(*row) for row in rows]
+        self._maps = (
+            {role.id: role for role in roles},
+            {role.name: role for role in roles},
+        )
+        # Set last: the version was read before loading, so a write racing
+        # with it triggers another load rather than being missed
+        self._version = version
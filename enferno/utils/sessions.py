@@ -0,0 +1,119 @@
+import atexit
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime
+
+from flask import has_app_context, session
+from sqlalchemy import and_, bindparam, delete, false, select, true, update
+
+TOUCH_INTERVAL = 60
+
+
+class SessionTracker:
+    """Keeps `user_sessions.last_active` and `expires_at` current, cheaply.
+
+    Requests only record the time a session was seen in an in-process dict;
+    every SESSION_TOUCH_INTERVAL seconds the whole dict is written with one
+    executemany UPDATE on its own connection. A busy session therefore costs
+    at most one row update per interval per worker, no matter how many
+    requests it makes, and requests never wait on a write to this table
+    except the one that happens to trigger the flush.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._seen = {}
+        self._last_flush = time.monotonic()
+        self._lock = threading.RLock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get("SESSION_TOUCH_INTERVAL", TOUCH_INTERVAL)
+        app.after_request(self._after_request)
+        atexit.register(self.flush)
+
+    def touch(self, session_token):
+        """Record that a session was just used."""
+        self._seen[session_token] = datetime.now()
+        if time.monotonic() - self._last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """Write all recorded last-seen times in one batched UPDATE."""
+        from enferno.extensions import db
+        from enferno.user.models import Session
+
+        ctx = nullcontext() if has_app_context() else self.app.app_context()
+        with self._lock, ctx:
+            self._last_flush = time.monotonic()
+            seen, self._seen = self._seen, {}
+            if not seen:
+                return
+
+            lifetime = self.app.permanent_session_lifetime
+            table = Session.__table__
+            statement = (
+                update(table)
+                .where(table.c.session_token == bindparam("token"))
+                .values(last_active=bindparam("seen"), expires_at=bindparam("expires"))
+            )
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(
+                        statement,
+                        [
+                            {"token": token, "seen": at, "expires": at + lifetime}
+                            for token, at in seen.items()
+                        ],
+                    )
+            except Exception as e:
+                # Last-seen times are advisory; losing one interval is harmless
+                self.app.logger.error(f"Session activity flush failed: {e}")
+
+    def _after_request(self, response):
+        # Only server-side sessions of logged in users have a user_sessions row
+        sid = getattr(session, "sid", None)
+        if sid and "_user_id" in session:
+            self.touch(sid)
+        return response
+
+
+def purge_sessions(inactive_for, batch_size=5000):
+    """Delete expired, logged out and idle session records in batches.
+
+    A session is purged when it was deactivated, when `expires_at` has passed,
+    or when it has not been seen for `inactive_for` (a timedelta). Rows are
+    deleted by primary key `batch_size` at a time, each batch in its own
+    transaction, so the purge never holds long locks on the table.
+
+    Yields the number of rows deleted after each batch.
+    """
+    from enferno.extensions import db
+    from enferno.user.models import Session
+
+    now = datetime.now()
+    table = Session.__table__
+    # One pass per condition, so each one is a range scan on its own index
+    conditions = (
+        table.c.is_active == false(),
+        and_(table.c.is_active == true(), table.c.last_active < now - inactive_for),
+        table.c.expires_at < now,
+    )
+
+    for condition in conditions:
+        while True:
+            ids = (
+                db.session.execute(
+                    select(table.c.id).where(condition).limit(batch_size)
+                )
+                .scalars()
+                .all()
+            )
+            if not ids:
+                break
+            db.session.execute(delete(table).where(table.c.id.in_(ids)))
+            db.session.commit()
+            yield len(ids)
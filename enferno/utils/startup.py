@@ -0,0 +1,78 @@
+import statistics
+import subprocess
+import sys
+from collections import Counter
+
+# Runs in a fresh interpreter: time importing the app and building it
+BOOT_SCRIPT = """
+import time
+started = time.perf_counter()
+from enferno.app import create_app
+imported = time.perf_counter()
+create_app()
+print(imported - started, time.perf_counter() - imported)
+"""
+
+
+def parse_importtime(output):
+    """Parse `python -X importtime` output into (module, self_us, cumulative_us)
+    tuples, in the order the imports finished."""
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        head, cumulative, name = line.split("|", 2)
+        modules.append(
+            (name.strip(), int(head.rsplit(":", 1)[1]), int(cumulative.strip()))
+        )
+    return modules
+
+
+def measure_boot():
+    """Boot the app once in a subprocess under -X importtime.
+
+    Returns (import_seconds, create_app_seconds, modules). Timings include
+    the importtime tracing overhead, so compare them with each other rather
+    than with production boot times.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", BOOT_SCRIPT],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    import_seconds, create_seconds = map(float, result.stdout.split()[-2:])
+    return import_seconds, create_seconds, parse_importtime(result.stderr)
+
+
+def boot_report(runs=3):
+    """Median boot timings over `runs` cold starts.
+
+    Returns a dict with import_ms, create_app_ms, modules (count) and
+    packages: (top-level package, self ms) pairs, slowest first, where a
+    package's time is the time spent in its own modules.
+    """
+    boots = [measure_boot() for _ in range(runs)]
+    packages = []
+    for _, _, modules in boots:
+        totals = Counter()
+        for name, self_us, _ in modules:
+            totals[name.split(".")[0]] += self_us
+        packages.append(totals)
+
+    names = set().union(*packages)
+    return {
+        "import_ms": statistics.median(b[0] for b in boots) * 1000,
+        "create_app_ms": statistics.median(b[1] for b in boots) * 1000,
+        "modules": len(boots[0][2]),
+        "packages": sorted(
+            (
+                (name, statistics.median(p[name] for p in packages) / 1000)
+                for name in names
+            ),
+            key=lambda row: row[1],
+            reverse=True,
+        ),
+    }
@@ -0,0 +1,50 @@
+import os
+from time import perf_counter
+
+from jinja2 import FileSystemBytecodeCache, TemplateError
+
+
+def bytecode_cache(app):
+    """A Jinja bytecode cache in JINJA_BYTECODE_CACHE_DIR, or None if unset.
+
+    Compiled templates are written there once and loaded by every worker,
+    and after restarts, instead of being compiled again. Entries are keyed
+    by template name and checked against the source, so edited templates
+    are recompiled. Must be set before app.jinja_env is first used.
+    """
+    directory = app.config.get("JINJA_BYTECODE_CACHE_DIR")
+    if not directory:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    return FileSystemBytecodeCache(directory)
+
+
+def compile_templates(app):
+    """Load every template the app can render into its Jinja environment.
+
+    Templates missing from the bytecode cache are compiled and written to
+    it; the rest are loaded from it. Either way they end up in the
+    environment's in-memory cache, so rendering doesn't compile them again.
+
+    Returns (loaded, errors): the number of templates loaded and a list of
+    (name, error) pairs for those that failed to compile.
+    """
+    loaded, errors = 0, []
+    for name in app.jinja_env.list_templates():
+        try:
+            app.jinja_env.get_template(name)
+            loaded += 1
+        except TemplateError as e:
+            errors.append((name, e))
+    return loaded, errors
+
+
+def preload_templates(app):
+    """Compile templates at boot, logging failures and how long it took."""
+    started = perf_counter()
+    loaded, errors = compile_templates(app)
+    for name, error in errors:
+        app.logger.error(f"Template {name} failed to compile: {error}")
+    app.logger.debug(
+        f"Loaded {loaded} templates in {(perf_counter() - started) * 1000:.0f}ms"
+    )
@@ -0,0 +1,31 @@
+from sqlalchemy.dialects import postgresql, sqlite
+
+from enferno.extensions import db
+
+DIALECT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+def supports_upsert():
+    """True if the database has a native INSERT ... ON CONFLICT."""
+    return db.engine.dialect.name in DIALECT_INSERTS
+
+
+def upsert(table, values, index_elements, update=None):
+    """Build a native INSERT ... ON CONFLICT statement for Postgres or SQLite.
+
+    `values` is a dict, or a list of dicts for a multi-row insert. On a
+    conflict with the unique `index_elements`, the columns in `update` (a dict
+    of column name to value, or a list of names to take from the new row) are
+    updated; without `update` the conflicting rows are skipped.
+
+    Check supports_upsert() first; other databases need a query-then-write.
+    """
+    statement = DIALECT_INSERTS[db.engine.dialect.name](table).values(values)
+    if not update:
+        return statement.on_conflict_do_nothing(index_elements=index_elements)
+    if not isinstance(update, dict):
+        update = {name: statement.excluded[name] for name in update}
+    return statement.on_conflict_do_update(index_elements=index_elements, set_=update)
@@ -0,0 +1,234 @@
+import csv
+import secrets
+from datetime import datetime
+from itertools import islice
+
+from flask_security.proxies import _security
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from enferno.extensions import db, hasher, role_registry
+from enferno.user.models import Role, User, roles_users
+from enferno.utils.counters import adjust
+
+BATCH_SIZE = 500
+MAX_ERRORS = 100
+
+TRUE_VALUES = {"1", "true", "yes", "y", "t"}
+
+
+def import_users(
+    file, update_existing=False, batch_size=BATCH_SIZE, create_roles=False
+):
+    """Import users from a CSV file object, `batch_size` rows at a time.
+
+    Columns match `flask users export -f csv`: `email` is required; `name`,
+    `username`, `password` (plain text), `active`, `roles` (names separated
+    by ";") and `created_at` are optional, and `id` is ignored. Users without
+    a password get a random one they don't know, like OAuth sign-ups.
+
+    Each batch costs one SELECT for existing emails, one concurrent round of
+    password hashing across the hashing pool, multi-row INSERTs for users and
+    role links, and one commit. Role names are resolved from an in-memory map;
+    rows naming a role that doesn't exist fail, unless `create_roles` is set,
+    in which case each new role is created once. Only one batch is held in
+    memory.
+
+    Emails are normalised and matched case-insensitively, as Flask-Security
+    does at sign-in. Existing emails are skipped, or with `update_existing`
+    updated in place (blank cells keep the current value and the stored
+    email, a non-empty `roles` cell replaces the user's roles). A batch that violates a constraint, e.g. a duplicate
+    username, is retried row by row so only the offending rows fail.
+
+    Yields a stats dict (created, updated, skipped, failed, errors) after
+    each batch.
+    """
+    reader = csv.DictReader(file)
+    if "email" not in (reader.fieldnames or []):
+        raise ValueError("The CSV file needs an email column")
+
+    role_ids = {role.name: role.id for role in role_registry.all()}
+    stats = {"created": 0, "updated": 0, "skipped": 0, "failed": 0, "errors": []}
+    # Line numbers start at 2, after the header
+    rows = enumerate(reader, start=2)
+
+    while batch := list(islice(rows, batch_size)):
+        _import_batch(batch, role_ids, update_existing, create_roles, stats)
+        yield stats
+
+
+def _import_batch(batch, role_ids, update_existing, create_roles, stats):
+    entries = {}
+    for line, row in batch:
+        try:
+            entry = _parse(row)
+        except ValueError as e:
+            _fail(stats, line, str(e))
+            continue
+        unknown = [name for name in entry["roles"] if name not in role_ids]
+        if unknown and not create_roles:
+            _fail(stats, line, f"unknown roles {', '.join(unknown)}")
+            continue
+        # A later row for the same email replaces an earlier one
+        entries[entry["key"]] = (line, entry)
+
+    email = func.lower(User.email)
+    existing = dict(
+        db.session.execute(select(email, User.id).where(email.in_(list(entries)))).all()
+    )
+    if not update_existing:
+        stats["skipped"] += len(existing)
+        entries = {e: v for e, v in entries.items() if e not in existing}
+
+    # Hash everything the batch needs in one parallel round
+    to_hash = [
+        (entry, entry["password"] or secrets.token_urlsafe(32))
+        for _, entry in entries.values()
+        if entry["password"] or entry["key"] not in existing
+    ]
+    for (entry, _), hashed in zip(
+        to_hash,
+        hasher.hash_many([password for _, password in to_hash]),
+        strict=True,
+    ):
+        entry["password_set"] = entry["password"] is not None
+        entry["password"] = hashed
+
+    _create_missing_roles(entries.values(), role_ids)
+
+    items = list(entries.values())
+    try:
+        created, updated = _write(items, existing, role_ids)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        created = updated = 0
+        for line, entry in items:
+            try:
+                with db.session.begin_nested():
+                    c, u = _write([(line, entry)], existing, role_ids)
+                created, updated = created + c, updated + u
+            except IntegrityError as e:
+                _fail(stats, line, str(e.orig))
+        db.session.commit()
+
+    # Core inserts bypass the ORM events that maintain the dashboard counters
+    adjust(User.__tablename__, created)
+    stats["created"] += created
+    stats["updated"] += updated
+
+
+def _parse(row):
+    email = (row.get("email") or "").strip()
+    try:
+        email = _security.mail_util.normalize(email)
+    except ValueError:
+        raise ValueError(f"invalid email {email!r}") from None
+
+    created_at = (row.get("created_at") or "").strip()
+    active = (row.get("active") or "").strip().lower()
+    return {
+        "email": email,
+        "key": email.lower(),
+        "name": (row.get("name") or "").strip() or None,
+        "username": (row.get("username") or "").strip() or None,
+        "password": row.get("password") or None,
+        "active": active in TRUE_VALUES if active else None,
+        "roles": list(
+            dict.fromkeys(
+                r.strip() for r in (row.get("roles") or "").split(";") if r.strip()
+            )
+        ),
+        "created_at": datetime.fromisoformat(created_at) if created_at else None,
+    }
+
+
+def _create_missing_roles(entries, role_ids):
+    names = {name for _, entry in entries for name in entry["roles"]} - role_ids.keys()
+    if names:
+        rows = db.session.execute(
+            insert(Role).returning(Role.name, Role.id), [{"name": n} for n in names]
+        ).all()
+        # Commit now so a row-by-row retry of the batch can still use them
+        db.session.commit()
+        role_ids.update(dict(rows))
+        adjust(Role.__tablename__, len(rows))
+
+
+def _write(items, existing, role_ids):
+    """Write parsed rows without committing. Returns (created, updated)."""
+    new = [entry for _, entry in items if entry["key"] not in existing]
+    changed = [entry for _, entry in items if entry["key"] in existing]
+    links = []
+
+    if new:
+        # insertmanyvalues batches these into multi-row INSERT ... RETURNING
+        rows = db.session.execute(
+            insert(User).returning(User.id, User.email, sort_by_parameter_order=True),
+            [
+                {
+                    "email": entry["email"],
+                    "name": entry["name"],
+                    "username": entry["username"],
+                    "password": entry["password"],
+                    "password_set": entry["password_set"],
+                    "active": True if entry["active"] is None else entry["active"],
+                    "created_at": entry["created_at"] or datetime.now(),
+                }
+                for entry in new
+            ],
+        ).all()
+        ids = {email: user_id for user_id, email in rows}
+        links += [
+            {"user_id": ids[entry["email"]], "role_id": role_ids[name]}
+            for entry in new
+            for name in entry["roles"]
+        ]
+
+    if changed:
+        table = User.__table__
+        # Blank cells arrive as NULL and keep the stored value
+        db.session.execute(
+            update(table)
+            .where(table.c.id == bindparam("b_id"))
+            .values(
+                name=func.coalesce(bindparam("b_name"), table.c.name),
+                username=func.coalesce(bindparam("b_username"), table.c.username),
+                active=func.coalesce(bindparam("b_active"), table.c.active),
+                password=func.coalesce(bindparam("b_password"), table.c.password),
+                password_set=func.coalesce(
+                    bindparam("b_password_set"), table.c.password_set
+                ),
+            ),
+            [
+                {
+                    "b_id": existing[entry["key"]],
+                    "b_name": entry["name"],
+                    "b_username": entry["username"],
+                    "b_active": entry["active"],
+                    "b_password": entry["password"],
+                    "b_password_set": entry.get("password_set"),
+                }
+                for entry in changed
+            ],
+        )
+        replaced = [existing[entry["key"]] for entry in changed if entry["roles"]]
+        if replaced:
+            db.session.execute(
+                delete(roles_users).where(roles_users.c.user_id.in_(replaced))
+            )
+        links += [
+            {"user_id": existing[entry["key"]], "role_id": role_ids[name]}
+            for entry in changed
+            for name in entry["roles"]
+        ]
+
+    if links:
+        db.session.execute(insert(roles_users), links)
+    return len(new), len(changed)
+
+
+def _fail(stats, line, message):
+    stats["failed"] += 1
+    if len(stats["errors"]) < MAX_ERRORS:
+        stats["errors"].append(f"line {line}: {message}")
@@ -0,0 +1,122 @@
+import hashlib
+import secrets
+from functools import wraps
+
+import orjson as json
+from flask import Response, make_response, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+from sqlalchemy.sql.dml import UpdateBase
+
+from enferno.extensions import cache
+
+# Tables something depends on the version of; writes to the rest aren't tracked
+TRACKED_TABLES = set()
+
+
+def _key(table):
+    return f"table-version:{table}"
+
+
+def table_versions(*tables):
+    """The current version of each table, from the cache (no database access).
+
+    A table without a version, because it was never written to or the cache
+    was flushed, starts at a random one, so an old version (and any ETag built
+    from it) can't come back.
+    """
+    versions = []
+    for table in tables:
+        version = cache.get(_key(table))
+        if version is None:
+            cache.add(_key(table), secrets.randbits(48), timeout=0)
+            version = cache.get(_key(table))
+        versions.append(version)
+    return versions
+
+
+def bump_versions(*tables):
+    """Give each table a new version."""
+    for table in tables:
+        if cache.cache.inc(_key(table)) == 1:
+            # inc() started from nothing; see table_versions
+            cache.set(_key(table), secrets.randbits(48), timeout=0)
+
+
+def conditional(*tables):
+    """Serve a GET view with a strong ETag and answer 304 Not Modified when the
+    client's copy is current.
+
+    The ETag is derived from the versions of `tables` (everything the view
+    reads) and the query string, and checked before the view runs, so a 304
+    doesn't query the database. Responses are marked private and no-cache:
+    browsers keep them but revalidate on every request, which XHR and fetch()
+    do transparently.
+    """
+    TRACKED_TABLES.update(tables)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Versions are read before the view queries, so a write racing
+            # with it can only make the ETag older than the data, never newer
+            state = [
+                request.endpoint,
+                table_versions(*tables),
+                sorted(request.args.items(multi=True)),
+            ]
+            etag = hashlib.sha1(json.dumps(state)).hexdigest()
+
+            # Weak comparison, as If-None-Match requires: compressed
+            # responses carry the same ETag marked weak
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+# Writes are tracked per connection rather than through ORM events, so Core
+# statements (bulk operations, imports, audit rows) and association tables are
+# covered too
+
+
+@event.listens_for(Engine, "after_execute")
+def _record_write(conn, clauseelement, multiparams, params, execution_options, result):
+    if isinstance(clauseelement, UpdateBase):
+        table = getattr(clauseelement.table, "name", None)
+        if table in TRACKED_TABLES:
+            conn.info.setdefault("written_tables", set()).add(table)
+
+
+@event.listens_for(Engine, "commit")
+def _record_commit(conn):
+    tables = conn.info.pop("written_tables", None)
+    if tables:
+        conn.info.setdefault("committed_tables", set()).update(tables)
+
+
+@event.listens_for(Engine, "rollback")
+def _forget_writes(conn):
+    conn.info.pop("written_tables", None)
+
+
+@event.listens_for(Pool, "checkin")
+def _bump_committed(dbapi_connection, connection_record):
+    # The commit event fires before the COMMIT is sent; bumping once the
+    # connection is back in the pool keeps a reader from pairing the new
+    # version with the old data
+    if connection_record is not None:
+        tables = connection_record.info.pop("committed_tables", None)
+        if tables:
+            bump_versions(*tables)